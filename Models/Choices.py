@@ -0,0 +1,44 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# The model types, discretization types, data sets and KNN indexes that can be selected, kept apart from the model modules
+# so cli.py can check its arguments without importing pandas or SKLearn (see benchmarks/import_time.py)
+
+# Neighbor search backends of the KNN models (see KNN.Indexes)
+KNNIndexes = ("auto", "brute", "kdtree", "balltree", "table", "hnsw")
+
+# The model types, description: [Module, Class] (see ModelBuilder.ModelTypes),
+# the model modules (and SKLearn with them) are only imported when a model of their type is built
+ModelTypes = {
+    "Type1 NBC model, {0} disc": ("Models.Type1Bayes", "Type1Bayes"), # Lab 4 Naive Bayes classifier
+    "Type2 NBC model, {0} disc": ("Models.Type2Bayes", "Type2Bayes"),
+    "Type1 Tree model, {0} disc": ("Models.Type1ID3Tree", "Type1ID3Tree"), # Lab 5 ID3 classifier
+    "Type2 Tree model, {0} disc": ("Models.Type2Tree", "Type2Tree"),
+    "KNN model, {0} disc": ("Models.KNN", "KNN"),
+    "KMEANS model, {0} disc": ("Models.KMEANS", "KMEANS"),
+}
+DiscTypes = ("equal width", "equal depth", "entropy")
+# Data sets the models can be evaluated on: the processed training data, the training data before processing
+# (encoded with the training bins) and the test file
+EvalSets = ("processed", "unprocessed", "test")
+
+# The choices selected by names (matched case insensitively, with "-" and "_" as spaces) in the order of choices,
+# every choice if names is None
+def SelectNames(names, choices, kind):
+    if names is None:
+        return list(choices)
+    keys = {choice.lower(): choice for choice in choices}
+    selected = [name.lower().replace("-", " ").replace("_", " ") for name in names]
+    unknown = [name for name, key in zip(names, selected) if key not in keys]
+    if len(selected) == 0:
+        raise ValueError(f"No {kind} were selected")
+    if unknown:
+        raise ValueError(f"Invalid {kind} {', '.join(unknown)}, expected some of: {', '.join(choices)}")
+    return [choice for choice in choices if choice.lower() in selected]
+
+# The ModelTypes entries of the model class names in names (e.g. ["knn", "type2tree"]), every entry if names is None
+def SelectModels(names, kind = "model types"):
+    classes = {name: entry for entry, (_, name) in ModelTypes.items()}
+    return [classes[name] for name in SelectNames(names, list(classes), kind)]
@@ -3,40 +3,86 @@
 # Dor Rozenhak
 # Roi Amzallag
 
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import OrdinalEncoder
-from Utilities.PDUtils import IsInterval, FindBestInterval, SplitXY
+from Utilities.PDUtils import SplitXY, EncodeDataFrame, BuildIntervalLookups
 
 class KMEANS:
-    "KMeans Model implemented with SKLearn classes"
+    '''
+    KMeans Model implemented with SKLearn classes\n
+    clusters - number of clusters\n
+    kmeans_batch - mini batch size, fits MiniBatchKMeans instead of the full batch KMeans if given,
+    the mini batch model can also be fit chunk by chunk with partial_fit\n
+    The first fit always runs on the whole df (MiniBatchKMeans.fit goes over it in mini batches), only partial_fit is incremental
+    '''
     def __init__(self, df, **kwargs):
         x, y = SplitXY(df)
-        clus_count = 8 if "cluster" not in kwargs else kwargs["cluster"]
+        clus_count = 8 if "clusters" not in kwargs or kwargs["clusters"] is None else kwargs["clusters"]
+        batch_size = None if "kmeans_batch" not in kwargs else kwargs["kmeans_batch"]
         if "encoder" not in kwargs or kwargs["encoder"] is None:
             self.encoder = OrdinalEncoder().fit(x)
         else:
             self.encoder = kwargs["encoder"]
+        # Interval lookups are shared between models of the same discretization if given
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = BuildIntervalLookups(x, self.encoder.categories_)
+        else:
+            self.lookups = kwargs["lookups"]
+        # Category code remaps of the categorical columns this model encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
 
         self.common_class = y.value_counts().idxmax()
-        self.model = KMeans(n_clusters = clus_count)
-        self.model.fit(self.encoder.transform(x))
-        # The clusterID -> class label as requested in the assignment document
-        # Prepare placeholder df to store temporary counts
-        cls_count_df = pd.DataFrame(0, index=y.unique(), columns=pd.RangeIndex(clus_count))
-        # Iterate on the labels in the model and the dataframe
-        for clus_idx, row_class in zip(self.model.labels_, y):
-            cls_count_df.at[row_class, clus_idx] += 1
-        # Pick class value with highest count
-        self.cluster_classes = [cls_count_df[col].idxmax() for col in cls_count_df]
+        if batch_size is None:
+            self.model = KMeans(n_clusters = clus_count)
+        else:
+            self.model = MiniBatchKMeans(n_clusters = clus_count, batch_size = batch_size)
+        self.model.fit(EncodeDataFrame(x, self.encoder.categories_, self.lookups))
+        # The clusterID -> class label as requested in the assignment document,
+        # picked from the cluster x class counts of the rows
+        self.classes = pd.Index(y.unique())
+        self.class_counts = np.zeros((clus_count, len(self.classes)), dtype=np.int64)
+        self.addCounts(self.model.labels_, self.classes.get_indexer(y))
+
+    def partial_fit(self, df):
+        '''Fold the labelled rows of df into the model, rows with unknown values or class values are skipped\n
+           Mini batch models also move their cluster centers, full batch models only update the cluster classes'''
+        x, y = SplitXY(df)
+        codes = EncodeDataFrame(x, self.encoder.categories_, self.lookups, self.remaps)
+        class_codes = self.classes.get_indexer(y)
+        known = (codes >= 0).all(axis=1) & (class_codes >= 0)
+        if known.any():
+            if isinstance(self.model, MiniBatchKMeans):
+                self.model.partial_fit(codes[known])
+            self.addCounts(self.model.predict(codes[known]), class_codes[known])
+        return self
+
+    def addCounts(self, labels, class_codes):
+        '''Add the (cluster, class) pairs of the rows to the counts with a single bincount and pick the class of every cluster'''
+        clus_count, class_count = self.class_counts.shape
+        self.class_counts += np.bincount(labels * class_count + class_codes,
+                                         minlength=clus_count * class_count).reshape(clus_count, class_count)
+        # Pick class value with highest count (the first one seen in the training data on ties)
+        self.cluster_classes = list(self.classes[self.class_counts.argmax(axis=1)])
+
     def evaluate(self, row):
         row = row.drop(labels=["class"])
-        for label, intervals in zip(row.index, self.encoder.categories_):
-            if IsInterval(intervals[0]):
-                row[label] = FindBestInterval(row[label], intervals)
+        for label in row.index:
+            if label in self.lookups:
+                row[label] = self.lookups[label].find(row[label])
         try:
             clus_idx = self.model.predict(self.encoder.transform([row]))[0]
             return self.cluster_classes[clus_idx]
         except Exception:
             # Return most common class
             return self.common_class
+
+    def predict_batch(self, df):
+        "Classify all the rows of df at once, rows with unknown values get the most common class"
+        codes = EncodeDataFrame(df.drop(labels=["class"], axis=1, errors="ignore"), self.encoder.categories_, self.lookups, self.remaps)
+        known = (codes >= 0).all(axis=1)
+        results = np.full(len(codes), self.common_class, dtype=object)
+        if known.any():
+            results[known] = np.array(self.cluster_classes, dtype=object)[self.model.predict(codes[known])]
+        return results
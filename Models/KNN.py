@@ -5,13 +5,240 @@
 
 # dor responcebilty
 import math
+import numpy as np
+from collections import OrderedDict
 
 from sklearn.preprocessing import OrdinalEncoder
 from sklearn.neighbors import KNeighborsClassifier
-from Utilities.PDUtils import IsInterval, FindBestInterval, SplitXY
+from Utilities.PDUtils import SplitXY, EncodeDataFrame, EncodeValue, BuildIntervalLookups
+from Models.Choices import KNNIndexes
+
+class DistinctVectors:
+    '''
+    Training rows grouped by their distinct encoded vectors (with per vector class counts), the k nearest neighbors vote
+    of the exact (DistanceTableIndex) and approximate (HNSWIndex) searches over them.\n
+    Neighbors at the same distance are picked by the first appearance of their vector, then in training row order
+    '''
+    # Queries are scored this many at a time to bound the (queries x vectors) distance matrix
+    BATCH_SIZE = 128
+    def __init__(self, codes, y, n_neighbors):
+        # Sorted class values, same as KNeighborsClassifier.classes_
+        self.classes_, row_classes = np.unique(y, return_inverse=True)
+        vectors, first_seen, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+        # Number the distinct vectors in order of appearance
+        order = np.argsort(first_seen)
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        self.vectors, inverse = vectors[order].astype(np.int64), ranks[inverse.reshape(-1)]
+        self.counts = np.bincount(inverse, minlength=len(self.vectors))
+        # Class counts of every vector, and running class counts of the rows grouped by vector (in row order)
+        onehot = np.eye(len(self.classes_), dtype=np.int64)[row_classes[np.argsort(inverse, kind="stable")]]
+        self.running = np.vstack([np.zeros((1, len(self.classes_)), dtype=np.int64), np.cumsum(onehot, axis=0)])
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        self.class_counts = self.running[self.starts + self.counts] - self.running[self.starts]
+        self.n_neighbors = min(n_neighbors, len(codes))
+
+    def vote(self, distances, ids = None):
+        '''
+        Most common class of the k nearest training rows of every query (ties go to the first class, like KNeighborsClassifier)\n
+        distances - (queries x vectors) squared distances, to every distinct vector if ids is None\n
+        ids - (queries x vectors) vector of every distance, in increasing order per query (-1 for no vector)
+        '''
+        k, rows = self.n_neighbors, np.arange(len(distances))
+        if ids is None:
+            counts = np.broadcast_to(self.counts, distances.shape)
+        else:
+            counts = np.where(ids >= 0, self.counts[ids], 0)
+            class_counts = np.where((ids >= 0)[:, :, None], self.class_counts[ids], 0)
+        def ClassVotes(selected):
+            # Counts are summed with float matrix products (exact for these sizes)
+            if ids is None:
+                return selected.astype(np.float64) @ self.class_counts
+            return np.einsum("qv,qvc->qc", selected.astype(np.float64), class_counts)
+        # The k nearest rows are in the k nearest distinct vectors, which give the distance of the k-th nearest row
+        if distances.shape[1] > k:
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+        nearest_dist = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_dist, axis=1, kind="stable")
+        nearest, nearest_dist = np.take_along_axis(nearest, order, axis=1), np.take_along_axis(nearest_dist, order, axis=1)
+        within = (np.cumsum(np.take_along_axis(counts, nearest, axis=1), axis=1) < k).sum(axis=1)
+        boundary = nearest_dist[rows, np.minimum(within, nearest.shape[1] - 1)][:, None]
+        # Every row closer than the boundary is a neighbor
+        inside = distances < boundary
+        votes = ClassVotes(inside)
+        needed = k - (inside * counts).sum(axis=1)
+        # Then whole vectors at the boundary distance while they fit, and the first rows of the next one
+        at_boundary = np.where(distances == boundary, counts, 0)
+        taken = np.cumsum(at_boundary, axis=1)
+        whole = (at_boundary > 0) & (taken <= needed[:, None])
+        votes += ClassVotes(whole)
+        rest = needed - (whole * at_boundary).sum(axis=1)
+        partial = np.argmax((at_boundary > 0) & (taken > needed[:, None]), axis=1)
+        starts = self.starts[partial if ids is None else np.maximum(ids[rows, partial], 0)]
+        votes += np.where(rest[:, None] > 0, self.running[starts + np.maximum(rest, 0)] - self.running[starts], 0)
+        return votes.argmax(axis=1)
+
+class DistanceTableIndex(DistinctVectors):
+    '''
+    Exact euclidean k nearest neighbors search for small discrete code spaces\n
+    The squared distance of every category code of every column to every distinct training vector is precomputed into
+    a table per column, the distances of a batch of queries to all the vectors are then the sums of their table rows.
+    The tables are rebuilt from the vectors when the model is loaded instead of being saved with it
+    '''
+    def __init__(self, codes, y, n_neighbors, sizes = None):
+        super().__init__(codes, y, n_neighbors)
+        # Number of category codes of every column
+        self.sizes = list(codes.max(axis=0) + 1) if sizes is None else list(sizes)
+        self.buildTables()
+
+    def buildTables(self):
+        # float32 is exact, the distances are sums of squares of small integers
+        self.tables = [((np.arange(size)[:, None] - self.vectors[None, :, col]) ** 2).astype(np.float32)
+                       for col, size in enumerate(self.sizes)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["tables"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buildTables()
+
+    def predict(self, queries):
+        results = np.empty(len(queries), dtype=np.int64)
+        for start in range(0, len(queries), self.BATCH_SIZE):
+            batch = queries[start:start + self.BATCH_SIZE]
+            distances = self.tables[0][batch[:, 0]]
+            for col in range(1, len(self.tables)):
+                distances += self.tables[col][batch[:, col]]
+            results[start:start + len(batch)] = self.vote(distances)
+        return self.classes_[results]
+
+class HNSWIndex(DistinctVectors):
+    '''
+    Approximate euclidean k nearest neighbors search with a hierarchical navigable small world graph (HNSW like)
+    over the distinct training vectors\n
+    Every vector gets a random level, layer l links the vectors of level l and up to their M nearest vectors found
+    when they were inserted (up to 2M on layer 0, the farthest links are dropped). Vectors are inserted in batches that
+    search the graph built so far together, a batch is at most as large as the graph.
+    Queries go down the upper layers greedily and search the bottom layer keeping the EF_SEARCH nearest vectors found,
+    the k nearest rows are then voted from these vectors only
+    '''
+    M = 12
+    EF_CONSTRUCTION = 48
+    EF_SEARCH = 64
+    INSERT_BATCH = 512
+    def __init__(self, codes, y, n_neighbors, seed = 0):
+        super().__init__(codes, y, n_neighbors)
+        count = len(self.vectors)
+        levels = np.floor(-np.log(1 - np.random.RandomState(seed).uniform(size=count)) / math.log(self.M)).astype(np.int64)
+        # Vectors are inserted from the highest level down, the first one is the entry point of every search
+        order = np.argsort(-levels, kind="stable")
+        self.entry = order[0]
+        # Neighbors of every vector on every layer, -1 padded (and for the vectors that are not on the layer)
+        self.graphs = [np.full((count, 2 * self.M if layer == 0 else self.M), -1, dtype=np.int64) for layer in range(levels.max() + 1)]
+        inserted = 1
+        while inserted < count:
+            batch = order[inserted:inserted + min(inserted, self.INSERT_BATCH)]
+            self.insert(batch, levels[batch])
+            inserted += len(batch)
+
+    def distances(self, queries, ids):
+        '''Squared distances of every query to the vectors of its row of ids (inf for -1)'''
+        diffs = self.vectors[np.maximum(ids, 0)] - queries[:, None, :]
+        return np.where(ids >= 0, (diffs ** 2).sum(axis=2), np.inf)
+
+    def search(self, queries, entries, graph, ef):
+        '''
+        Beam search of a layer for every query at once, from its entry vector\n
+        returns (ids, distances) of the ef nearest vectors found for every query, nearest first (-1 and inf padded)
+        '''
+        count = len(queries)
+        ids = np.full((count, ef), -1, dtype=np.int64)
+        dists = np.full((count, ef), np.inf)
+        expanded = np.zeros((count, ef), dtype=bool)
+        visited = np.zeros((count, len(self.vectors)), dtype=bool)
+        ids[:, 0] = entries
+        dists[:, 0] = self.distances(queries, entries[:, None])[:, 0]
+        visited[np.arange(count), entries] = True
+        active = np.arange(count)
+        while True:
+            # Expand the nearest vector of every list that was not expanded yet, until every listed vector was
+            pending = ~expanded[active] & (ids[active] >= 0)
+            active = active[pending.any(axis=1)]
+            if len(active) == 0:
+                return ids, dists
+            position = np.argmax(pending[pending.any(axis=1)], axis=1)
+            expanded[active, position] = True
+            neighbors = graph[ids[active, position]]
+            query_rows = np.broadcast_to(active[:, None], neighbors.shape)
+            fresh = neighbors >= 0
+            fresh[fresh] = ~visited[query_rows[fresh], neighbors[fresh]]
+            visited[query_rows[fresh], neighbors[fresh]] = True
+            neighbors = np.where(fresh, neighbors, -1)
+            # Merge the new vectors into the lists
+            merged_ids = np.concatenate([ids[active], neighbors], axis=1)
+            merged_dists = np.concatenate([dists[active], self.distances(queries[active], neighbors)], axis=1)
+            merged_expanded = np.concatenate([expanded[active], np.zeros(neighbors.shape, dtype=bool)], axis=1)
+            order = np.argsort(merged_dists, axis=1, kind="stable")[:, :ef]
+            ids[active] = np.take_along_axis(merged_ids, order, axis=1)
+            dists[active] = np.take_along_axis(merged_dists, order, axis=1)
+            expanded[active] = np.take_along_axis(merged_expanded, order, axis=1)
+
+    def insert(self, batch, levels):
+        queries = self.vectors[batch]
+        entries = np.full(len(batch), self.entry)
+        for layer in range(len(self.graphs) - 1, -1, -1):
+            linked = levels >= layer
+            ids = self.search(queries, entries, self.graphs[layer], self.EF_CONSTRUCTION if linked.any() else 1)[0]
+            entries = ids[:, 0]
+            if linked.any():
+                self.link(self.graphs[layer], batch[linked], ids[linked, :self.M])
+
+    def link(self, graph, new, nearest):
+        '''Links the new vectors to their nearest vectors both ways, keeping the nearest neighbors of every vector'''
+        graph[new, :nearest.shape[1]] = nearest
+        targets, sources = nearest.reshape(-1), np.repeat(new, nearest.shape[1])
+        sources, targets = sources[targets >= 0], targets[targets >= 0]
+        order = np.argsort(targets, kind="stable")
+        sources, targets = sources[order], targets[order]
+        nodes, firsts, added = np.unique(targets, return_index=True, return_counts=True)
+        extra = np.full((len(nodes), added.max()), -1, dtype=np.int64)
+        extra[np.repeat(np.arange(len(nodes)), added), np.arange(len(targets)) - np.repeat(firsts, added)] = sources
+        candidates = np.concatenate([graph[nodes], extra], axis=1)
+        dists = self.distances(self.vectors[nodes], candidates)
+        order = np.argsort(dists, axis=1, kind="stable")[:, :graph.shape[1]]
+        graph[nodes] = np.take_along_axis(candidates, order, axis=1)
+
+    def predict(self, queries):
+        results = np.empty(len(queries), dtype=np.int64)
+        ef = max(self.EF_SEARCH, self.n_neighbors)
+        for start in range(0, len(queries), self.BATCH_SIZE):
+            batch = queries[start:start + self.BATCH_SIZE].astype(np.int64)
+            entries = np.full(len(batch), self.entry)
+            for layer in range(len(self.graphs) - 1, 0, -1):
+                entries = self.search(batch, entries, self.graphs[layer], 1)[0][:, 0]
+            ids, dists = self.search(batch, entries, self.graphs[0], ef)
+            # Vote in vector order like the exact search, the padding goes last
+            order = np.argsort(np.where(ids >= 0, ids, len(self.vectors)), axis=1, kind="stable")
+            results[start:start + len(batch)] = self.vote(np.take_along_axis(dists, order, axis=1), np.take_along_axis(ids, order, axis=1))
+        return self.classes_[results]
 
 class KNN:
-    "KNN Model implemented with SKLearn classes"
+    '''
+    KNN Model implemented with SKLearn classes\n
+    knn_index - neighbor search backend, "auto", "brute", "kdtree", "balltree" (KNeighborsClassifier algorithms),
+    "table" (DistanceTableIndex, exact) or "hnsw" (HNSWIndex, approximate)\n
+    search_jobs - number of threads for the neighbor search (KNeighborsClassifier n_jobs)\n
+    Predictions are cached per distinct encoded vector, so repeated vectors are not searched again,
+    the cache keeps the CACHE_SIZE most recently used vectors and is not saved with the model
+    '''
+    # Index name (see Choices.KNNIndexes) -> KNeighborsClassifier algorithm
+    Indexes = dict(zip(KNNIndexes, ("auto", "brute", "kd_tree", "ball_tree", None, None)))
+    CACHE_SIZE = 100000
     def __init__(self , df , **kwargs):
         #split data
         x, y = SplitXY(df)
@@ -20,17 +247,72 @@ class KNN:
             self.encoder = OrdinalEncoder().fit(x)
         else:
             self.encoder = kwargs["encoder"]
+        # Interval lookups are shared between models of the same discretization if given
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = BuildIntervalLookups(x, self.encoder.categories_)
+        else:
+            self.lookups = kwargs["lookups"]
+        # Category code remaps of the categorical columns this model encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
+        # Category value -> position of every column, for encoding single rows (see evaluate)
+        self.category_codes = [{category: code for code, category in enumerate(categories)} for categories in self.encoder.categories_]
 
         Nneighbors = 5 if "neighbors" not in kwargs else kwargs["neighbors"]
-        self.classifier = KNeighborsClassifier(n_neighbors=Nneighbors, metric = 'euclidean')
-        self.classifier.fit(self.encoder.transform(x),y)
+        self.index = "auto" if "knn_index" not in kwargs or kwargs["knn_index"] is None else kwargs["knn_index"]
+        search_jobs = None if "search_jobs" not in kwargs else kwargs["search_jobs"]
+        if self.index not in KNN.Indexes:
+            raise ValueError(f"Unknown KNN index {self.index}, expected one of {', '.join(KNN.Indexes)}")
+        codes = EncodeDataFrame(x, self.encoder.categories_, self.lookups)
+        if self.index == "table":
+            self.classifier = DistanceTableIndex(codes, y, Nneighbors, [len(categories) for categories in self.encoder.categories_])
+        elif self.index == "hnsw":
+            self.classifier = HNSWIndex(codes, y, Nneighbors)
+        else:
+            self.classifier = KNeighborsClassifier(n_neighbors=Nneighbors, metric = 'euclidean',
+                                                   algorithm=KNN.Indexes[self.index], n_jobs=search_jobs)
+            self.classifier.fit(codes, y)
+        # Encoded vector (bytes) -> predicted class, in least recently used order
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        # The prediction cache is rebuilt after loading instead of being saved (and hashed by joblib.Memory)
+        state = self.__dict__.copy()
+        del state["cache"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = OrderedDict()
 
     def evaluate(self, row): # "yes" | "no" | None
-        row = row.drop(labels=["class"])
-        for label, intervals in zip(row.index, self.encoder.categories_):
-            if IsInterval(intervals[0]):
-                row[label] = FindBestInterval(row[label], intervals)
-        try:
-            return self.classifier.predict(self.encoder.transform([row]))[0]
-        except Exception:
+        values = [(col, value) for col, value in row.items() if col != "class"]
+        codes = np.array([EncodeValue(value, category_codes, self.lookups.get(col))
+                          for (col, value), category_codes in zip(values, self.category_codes)], dtype=np.int64)
+        if (codes < 0).any():
             return self.common_class
+        return self.predictCached([codes.tobytes()], codes[None, :])[0]
+
+    def predictCached(self, keys, vectors):
+        '''Predicted class of every vector (keys are their bytes), only the vectors that are not in the cache are searched'''
+        missing = [idx for idx, key in enumerate(keys) if key not in self.cache]
+        if len(missing) > 0:
+            self.cache.update(zip([keys[idx] for idx in missing], self.classifier.predict(vectors[missing])))
+        results = []
+        for key in keys:
+            self.cache.move_to_end(key)
+            results.append(self.cache[key])
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return results
+
+    def predict_batch(self, df):
+        "Classify all the rows of df at once, rows with unknown values get the most common class"
+        codes = EncodeDataFrame(df.drop(labels=["class"], axis=1, errors="ignore"), self.encoder.categories_, self.lookups, self.remaps)
+        known = (codes >= 0).all(axis=1)
+        results = np.full(len(codes), self.common_class, dtype=object)
+        if known.any():
+            # Search once per distinct vector that was not seen before, in one batched query
+            vectors, inverse = np.unique(codes[known], axis=0, return_inverse=True)
+            keys = [vector.tobytes() for vector in vectors]
+            results[known] = np.array(self.predictCached(keys, vectors), dtype=object)[inverse.reshape(-1)]
+        return results
@@ -5,21 +5,30 @@
 
 # Library imports
 from itertools import product
+import copy
 import os
+import re
+from importlib import import_module
+from os import path
+from time import perf_counter
 import pandas as pd
 import numpy as np
 import joblib as jb
-import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-
-# Internal function and model imports
-from Utilities.PDUtils import CleanDataFrame
-from Models.Type2Tree import Type2Tree
-from Models.Type1ID3Tree import Type1ID3Tree
-from Models.Type1Bayes import Type1Bayes
-from Models.Type2Bayes import Type2Bayes
-from Models.KNN import KNN
-from Models.KMEANS import KMEANS
+
+# Internal function imports, the model classes are imported on demand (see ModelBuilder.ModelClass)
+from Utilities.Metrics import ConfusionMatrices, ClassSupport, MetricsTable
+import Models.Choices as choices
+from Utilities.PDUtils import CleanDataFrame, LowerStrings, DistinctRows, ReadCSV, SaveCodes, LoadCodes, ReplaceFile
+
+# Runs a single model job in a worker process (see ModelBuilder.jobs),
+# the log lines are collected and returned so they can be replayed in order by the main process
+def RunModelJob(builder, modelEntry, modelDisc, eval_sets, model_kwargs, variants):
+    outputs = builder.RunModel(modelEntry, modelDisc, eval_sets, model_kwargs, variants)
+    return outputs, builder.log_buffer
+
+# Model parameters can be a single value or a list of values to sweep over
+def ParamValues(value):
+    return list(dict.fromkeys(value)) if isinstance(value, (list, tuple)) else [value]
 
 # Backend model generation and testing,
 # can be used as stand alone class or with the CLI (cli.py) or GUI
@@ -31,21 +40,34 @@ from Models.KMEANS import KMEANS
 # output_gui.done() : notify that all tasks are finished
 class ModelBuilder:
     # Types should have a common builder definition and interface methods
-    # So if we add a new model it would be a simple line addition to this dictionary and a import statement
+    # So if we add a new model it would be a simple line addition to the ModelTypes dictionary (and ModelParams)
     # Model(df, **kwargs) <- each constructor will take the relevant arguments from the kwargs
     # Model.evaluate(row) <- receives a row from a data set, including the class column
     #                        and returns a classification based upon the row data (excluding the class attribute)
+    # Model.predict_batch(df) <- same as evaluate but for a whole data set at once, returns an array of classifications
     # Generated models will be made as cartesian product of DiscTypes and ModelTypes
-    ModelTypes = {
-        # Description: [Class]
-        "Type1 NBC model, {0} disc": Type1Bayes, # Lab 4 Naive Bayes classifier
-        "Type2 NBC model, {0} disc": Type2Bayes, 
-        "Type1 Tree model, {0} disc": Type1ID3Tree, # Lab 5 ID3 classifier
-        "Type2 Tree model, {0} disc": Type2Tree,
-        "KNN model, {0} disc": KNN,
-        "KMEANS model, {0} disc": KMEANS,
+    # (and of the swept values of the parameters each model type uses, see ModelParams)
+    # The model modules (and SKLearn with them) are only imported when a model of their type is built
+    # The model, disc and data set names are kept in Models.Choices, so cli.py can check them without importing pandas
+    ModelTypes = choices.ModelTypes # Description: [Module, Class]
+    # The kwargs that change the model built by each type, used to key the model cache
+    # and to only rebuild the model types a swept parameter affects
+    ModelParams = {
+        "Type1 NBC model, {0} disc": (),
+        "Type2 NBC model, {0} disc": (),
+        "Type1 Tree model, {0} disc": ("min_gain", "leaf_limit"),
+        "Type2 Tree model, {0} disc": ("leaf_limit",),
+        "KNN model, {0} disc": ("neighbors", "knn_index"),
+        "KMEANS model, {0} disc": ("clusters", "kmeans_batch"),
     }
-    DiscTypes = ("equal width", "equal depth", "entropy")
+    # Model types that can derive their models for stricter values of these parameters from a single build,
+    # Model.pruned(**params) <- returns the model as if it was built with params
+    PrunedParams = {
+        "Type1 Tree model, {0} disc": ("min_gain", "leaf_limit"),
+    }
+    DiscTypes = choices.DiscTypes
+    # Data sets the models can be evaluated on (processed, unprocessed and test)
+    EvalSets = choices.EvalSets
     # Might more params in the future
     def __init__(self,
                  train_file,
@@ -58,79 +80,190 @@ class ModelBuilder:
                  jb_status = "disable",
                  neighbors = 5,
                  clusters = 8,
+                 jobs = 1,
+                 chunksize = None,
+                 cache_size = 1024,
+                 knn_index = "auto",
+                 search_jobs = None,
+                 kmeans_batch = None,
+                 report = "full",
+                 models = None,
+                 disc_types = None,
+                 eval_sets = None,
                  output_gui = None):
         # Set up general variables
         self.gui, self.jb_status, self.memory, self.models = output_gui, jb_status, None, []
+        self.jobs, self.log_buffer = jobs, None
+        # Reports to write, "none", "metrics" (metrics.csv and the confusion matrices) or "full" (also the per sample results and pdfs)
+        self.report = report
+        # Size limit of the model cache (in MB), the least recently used models are evicted first
+        self.cache_size = cache_size
+        # Streamed data sets only keep their confusion matrix counts, df_ident -> (classes, {modelDesc: matrix})
+        self.streamed = dict()
         self.write_dir = output_dir if output_dir is not None else path.split(path.abspath(train_file))[0]
+        # The data sets are read with the column types of the structure file if supplied
+        self.struct_file = struct_file
         self.gui_exists = output_gui is not None
+        # Only the selected model types (class names, see Choices.SelectModels) are built, only the disc types they use are processed
+        # and only the selected data sets (see EvalSets) are evaluated, everything is selected by default
+        self.model_types = choices.SelectModels(models)
+        self.disc_types = choices.SelectNames(disc_types, self.DiscTypes, "disc types")
+        eval_sets = choices.SelectNames(eval_sets, self.EvalSets, "data sets")
+        if "test" not in eval_sets:
+            test_file = None
+        # Saved processed training data is not reused if the joblib cache is purged
+        reuse_processed = jb_status == "enable"
         # Memoize CleanDataFrame
-        self.CleanDataFrame = self.memoize(CleanDataFrame)
+        self.CleanDataFrame = self.memoize(CleanDataFrame, ignore=["jobs"])
 
-        self.dataframes, self.encoders, self.specifics = dict(), dict(), dict()
+        self.dataframes, self.preprocessors, self.specifics = dict(), dict(), dict()
+        # Content hash of each processed training data frame (see CacheKey)
+        self.data_hashes = dict()
+        # Every parameter can be swept over a list of values, the swept ones are added to the model descriptions
+        grid = dict(bin_count = ParamValues(bin_count),
+                    min_gain = ParamValues(min_gain),
+                    leaf_limit = ParamValues(leaf_limit),
+                    neighbors = ParamValues(neighbors),
+                    clusters = ParamValues(clusters),
+                    knn_index = ParamValues(knn_index),
+                    kmeans_batch = ParamValues(kmeans_batch))
+        self.swept = [param for param, values in grid.items() if len(values) > 1]
+        # (bin count, disc type) -> the key of the processed data (dataframes, preprocessors...),
+        # which is just the disc type unless the bin count is swept
+        self.disc_keys = {(bins, disc): disc if len(grid["bin_count"]) == 1 else f"{bins} bins {disc}"
+                          for bins, disc in product(grid["bin_count"], self.disc_types)}
         # Initial cleanup
         self.log("Cleaning up training data")
-        train_df, _ = self.CleanDataFrame(pd.read_csv(train_file), -1, "none")
+        train_df, _ = self.CleanDataFrame(self.ReadCSV(train_file), -1, "none")
         self.TagDataFrame(train_df, "train data without discretization")
-        train_df.to_csv(self.GetPath("Training file cleaned.csv"))
+        if self.report == "full":
+            train_df.to_csv(self.GetPath("Training file cleaned.csv"))
 
-        for disc in self.DiscTypes:
-            self.log(f"Starting pre-processing with {disc} discretization")
-            self.dataframes[disc], self.encoders[disc] = self.CleanDataFrame(train_df, bin_count, disc, struct_file)
-            self.dataframes[disc].to_csv(self.GetPath(f"Training file processed using {disc} disc.csv"))
+        # With joblib enabled the processed training data is saved in a columnar binary form (see SaveProcessed)
+        # and reloaded instead of being processed again if it was processed from the same data with the same settings
+        struct_text = None
+        if struct_file is not None:
+            with open(struct_file) as struct:
+                struct_text = struct.read()
+        process_keys = {disc: jb.hash((train_df, bins, disc_type, struct_text)) for (bins, disc_type), disc in self.disc_keys.items()}
+        missing = [(bins, disc_type) for (bins, disc_type), disc in self.disc_keys.items()
+                   if not (reuse_processed and self.LoadProcessed(disc, process_keys[disc]))]
+        for bins, disc_type in missing:
+            self.log(f"Starting pre-processing with {self.disc_keys[(bins, disc_type)]} discretization")
+        # The discretization types (and bin counts) are independent, so they are processed in parallel (if jobs > 1),
+        # the numeric columns of train_df that are larger than the joblib max_nbytes (1 MB) are shared with the workers
+        # as read-only memory maps, smaller ones are pickled.
+        # The columns of a single one are only processed in parallel when the discretization types are not, to keep to self.jobs processes
+        process_jobs = max(min(self.jobs, len(missing)), 1)
+        column_jobs = self.jobs if process_jobs == 1 else 1
+        processed = jb.Parallel(n_jobs=process_jobs, mmap_mode="r")(
+            jb.delayed(CleanDataFrame)(train_df, bins, disc_type, struct_file, column_jobs) for bins, disc_type in missing)
+        for key, (df, preprocessor) in zip(missing, processed):
+            disc = self.disc_keys[key]
+            if self.report == "full":
+                df.to_csv(self.GetPath(f"Training file processed using {disc} disc.csv"))
+            self.preprocessors[disc] = preprocessor
+            self.SaveProcessed(df, disc, process_keys[disc])
+        for disc in self.disc_keys.values():
             self.TagDataFrame(self.dataframes[disc], f"train data with {disc} disc")
+            if self.jb_status == "enable":
+                self.data_hashes[disc] = jb.hash(self.dataframes[disc])
+            self.SavePreprocessor(disc)
             self.log(f"Finished pre-processing with {disc} discretization")
 
-        if test_file is not None:
-            test_df = pd.read_csv(test_file)
+        # With a chunksize the test file is streamed through the models after they are built
+        if test_file is not None and chunksize is None:
+            test_df = self.ReadCSV(test_file)
             self.TagDataFrame(test_df, "test data")
 
+        # Every data set is encoded once per discretization type (bins and categories of the training data),
+        # the models then only receive encoded data. The model types with strict encoding get their own encoding (see StrictEncoding)
+        stricts = sorted({self.StrictEncoding(self.ModelClass(modelEntry)) for modelEntry in self.model_types})
+        encoded = dict()
+        for disc, strict in product(self.disc_keys.values(), stricts):
+            encoding = f"{disc} disc" + (" (strict)" if strict else "")
+            self.log(f"Encoding data sets with {encoding}")
+            # (data frame identity, data frame, description suffix)
+            data_sets = []
+            if "processed" in eval_sets:
+                data_sets.append((self.dataframes[disc].ident, self.dataframes[disc], "processed data"))
+            if "unprocessed" in eval_sets:
+                data_sets.append((train_df.ident, self.preprocessors[disc].transform(train_df, strict), "unprocessed data"))
+            if test_file is not None and chunksize is None:
+                data_sets.append((test_df.ident, self.preprocessors[disc].transform(test_df, strict), "test data"))
+            # The rows are grouped by their encoded values once, every model then only scores the distinct rows
+            encoded[(disc, strict)] = [(df_ident, df, suffix, self.Deduplicate(df, f"{encoding} {suffix}"))
+                                       for df_ident, df, suffix in data_sets]
+
         self.log("Starting model runs...")
-        for modelEntry, modelDisc in product(self.ModelTypes, self.DiscTypes):
-            modelDesc = modelEntry.format(modelDisc)
-            self.log(f"Building {modelDesc}")
+        jobs = []
+        for modelEntry, modelDisc in product(self.model_types, self.disc_keys.values()):
+            params = self.ModelParams[modelEntry]
+            # Swept parameters that can be pruned are covered by a single build per job
+            pruned = [param for param in self.PrunedParams.get(modelEntry, ()) if param in self.swept]
+            variants = [dict(zip(pruned, values)) for values in product(*[grid[param] for param in pruned])] if pruned else None
+            params = [param for param in params if param not in pruned]
+            # Only the parameters the model type uses are swept, so e.g. a neighbors sweep only rebuilds KNN
+            for values in product(*[grid[param] for param in params]):
+                # Add the aditional params here if they are added to __init__
+                model_kwargs = dict(min_gain = grid["min_gain"][0],
+                                    leaf_limit = grid["leaf_limit"][0],
+                                    neighbors = grid["neighbors"][0],
+                                    clusters = grid["clusters"][0],
+                                    knn_index = grid["knn_index"][0],
+                                    search_jobs = search_jobs,
+                                    kmeans_batch = grid["kmeans_batch"][0],
+                                    encoder = self.preprocessors[modelDisc].encoder,
+                                    lookups = self.preprocessors[modelDisc].lookups)
+                model_kwargs.update(zip(params, values))
+                jobs.append((modelEntry, modelDisc, encoded[(modelDisc, self.StrictEncoding(self.ModelClass(modelEntry)))],
+                             model_kwargs, variants))
 
-            # Add the aditional params here if they are added to __init__
-            modelObj = self.CreateModel(modelEntry,
-                                        modelDisc,
-                                        min_gain = min_gain,
-                                        leaf_limit = leaf_limit,
-                                        neighbors = neighbors,
-                                        clusters = clusters,
-                                        encoder = self.encoders[modelDisc])
+        if self.jobs == 1:
+            for job in jobs:
+                for modelObj, results in self.RunModel(*job):
+                    self.AddModelResults(modelObj, results)
+        else:
+            # Every job gets a light copy of the builder, results are merged back in the original order
+            job_outputs = jb.Parallel(n_jobs=self.jobs)(jb.delayed(RunModelJob)(self.JobCopy(job[1]), *job) for job in jobs)
+            for outputs, log_lines in job_outputs:
+                for line in log_lines:
+                    self.log(line)
+                for modelObj, results in outputs:
+                    self.AddModelResults(modelObj, results)
+        self.EvictModelCache()
 
-            self.log(f"Finished building {modelDesc}")
-            # Evaluate data
-            self.evaluate_df(self.dataframes[modelDisc], modelObj, f"{modelDesc}, processed data")
-            self.evaluate_df(train_df, modelObj, f"{modelDesc}, unprocessed data")
-            if test_file is not None:
-                self.evaluate_df(test_df, modelObj, f"{modelDesc}, test data")
-
-            # Keep object
-            self.models.append(modelObj)
-        self.log("Generating confusion matrix pdfs")
-        for df_ident in self.specifics:
+        if test_file is not None and chunksize is not None:
+            self.StreamEvaluate(test_file, "test data", chunksize)
+
+        # Confusion matrices of all the models of a data set are counted at once (see Utilities.Metrics)
+        evaluations = []
+        for df_ident in self.specifics if self.report != "none" else []:
             df = self.specifics[df_ident] # Simplify code a bit
-            df.to_csv(self.GetPath(f"Per sample results - {df_ident}.csv"))
-            y_true = df["class"]
-            y_preds = [df[col] for col in df.drop(labels=["class"], axis=1)]
-            classes = y_true.unique()
-            # Inspired by https://stackoverflow.com/questions/59165149/plot-confusion-matrix-with-scikit-learn-without-a-classifier
-            # And https://scikit-learn.org/0.18/auto_examples/model_selection/plot_confusion_matrix.html
-            cols, rows = len(self.DiscTypes), int(np.ceil(len(y_preds) / len(self.DiscTypes)))
-            fig, axes = plt.subplots(rows, cols, squeeze=False)
-            axes_list = []
-            for items in axes:
-                axes_list += [*items]
-            for y_pred, ax in zip(y_preds, axes_list):
-                mtx = confusion_matrix(y_true, y_pred, labels=classes)
-                ConfusionMatrixDisplay(mtx, display_labels=classes).plot(ax=ax, cmap=plt.cm.Blues)
-                ax.set_title(y_pred.name)
-                ax.set_ylabel("Expected class")
-                ax.set_xlabel("Predicted class")
-            fig.subplots_adjust(hspace=0.3, wspace=0.3)
-            fig.set_size_inches(cols * 5.2, rows * 4.1)
-            fig.savefig(self.GetPath(f"Confusion Matrix - {df_ident}.pdf"))
-        self.log("Finished generation of confusion matrix pdfs")
+            predictions = df.drop(labels=["class"], axis=1)
+            # Data sets that were not evaluated (see eval_sets) only have their class column
+            if len(predictions.columns) > 0:
+                if self.report == "full":
+                    df.to_csv(self.GetPath(f"Per sample results - {df_ident}.csv"))
+                classes = list(df["class"].unique())
+                matrices = ConfusionMatrices(df["class"].values, predictions.T.values, classes)
+                evaluations.append((df_ident, classes, dict(zip(predictions.columns, matrices)), ClassSupport(df["class"].values, classes)))
+        evaluations += [(df_ident, *streamed) for df_ident, streamed in self.streamed.items()]
+
+        if self.report != "none" and len(evaluations) == 0:
+            self.log("No data set was evaluated, skipping the metrics and reports")
+        elif self.report != "none":
+            self.log("Writing metrics table")
+            metrics = pd.concat([MetricsTable(*evaluation) for evaluation in evaluations], ignore_index=True)
+            metrics.to_csv(self.GetPath("metrics.csv"), index=False)
+            self.SaveMatrices(evaluations)
+
+        if self.report == "full" and len(evaluations) > 0:
+            self.log("Generating confusion matrix pdfs")
+            # Imported here so matplotlib is only loaded when the pdfs are drawn
+            from Utilities.Reports import RenderReports
+            RenderReports(self.write_dir, self.log)
+            self.log("Finished generation of confusion matrix pdfs")
 
         if self.gui_exists:
             # GUI/CLI should display/dump results into the requested medium
@@ -143,53 +276,275 @@ class ModelBuilder:
             self.gui, self.gui_exists = None, False
             jb.dump(self, builder_path)
 
+    def SaveMatrices(self, evaluations):
+        '''Save the confusion matrices of every data set, so the pdf reports can be drawn later (see Utilities.Reports)'''
+        # A pdf page holds one model of each selected type per selected disc type
+        saved = dict(evaluations=evaluations, cols=len(self.disc_types), page_size=len(self.model_types) * len(self.disc_types))
+        jb.dump(saved, self.GetPath("Confusion matrices.joblib"))
+
+    def StreamEvaluate(self, file_path, df_ident, chunksize):
+        '''
+        Evaluate all the models on a csv file that is read chunksize rows at a time\n
+        Only one chunk is kept in memory, the per sample results are appended to the results csv file
+        and the correct and confusion matrix counts are accumulated on the fly
+        '''
+        descs = [f"{modelObj.description}, {df_ident}" for modelObj in self.models]
+        # models x classes x classes counts and the rows of every class, grown when a chunk has new classes
+        classes, counts, total = [], np.zeros((len(self.models), 0, 0), dtype=np.int64), 0
+        support = np.zeros(0, dtype=np.int64)
+        results_path = self.GetPath(f"Per sample results - {df_ident}.csv")
+        self.log(f"Starting streamed evaluation of {df_ident} ({chunksize} rows per chunk)")
+        for chunk_idx, chunk in enumerate(ReadCSV(file_path, self.struct_file, chunksize)):
+            y_true = LowerStrings(chunk[["class"]])["class"]
+            new_classes = [value for value in y_true.unique() if value not in classes]
+            classes += new_classes
+            counts = np.pad(counts, ((0, 0), (0, len(new_classes)), (0, len(new_classes))))
+            support = np.pad(support, (0, len(new_classes))) + ClassSupport(y_true.values, classes)
+            results = y_true.to_frame()
+            # Encode the chunk once per discretization type (and strict encoding)
+            encoded = {key: self.preprocessors[key[0]].transform(chunk, key[1]) for key in dict.fromkeys(map(self.EncodingKey, self.models))}
+            distinct = {key: self.Deduplicate(df, f"chunk {chunk_idx} of {df_ident} ({key[0]} disc)") for key, df in encoded.items()}
+            for modelObj, modelDesc in zip(self.models, descs):
+                rows, groups = distinct[self.EncodingKey(modelObj)]
+                results[modelDesc] = np.asarray(modelObj.predict_batch(encoded[self.EncodingKey(modelObj)].iloc[rows]), dtype=object)[groups]
+            counts += ConfusionMatrices(y_true.values, results[descs].T.values, classes)
+            if self.report == "full":
+                results.to_csv(results_path, mode="w" if chunk_idx == 0 else "a", header=chunk_idx == 0)
+            total += len(chunk)
+            self.log(f"Evaluated {total} rows of {df_ident}")
+
+        for modelDesc, matrix in zip(descs, counts):
+            # Every class of the data set is in classes, so the correct results are the diagonal (None results are errors)
+            model_correct = int(np.trace(matrix))
+            info = {"Total Entries": total, "Correct": model_correct, "Errors": total - model_correct, "Error %": 0}
+            info["Error %"] = format((info["Errors"] / total) * 100, '.2f')
+            self.log(f"{modelDesc}: " + ", ".join([f"{key}: {info[key]}" for key in info]))
+            if self.gui_exists:
+                self.gui.addRow(pd.Series(info, name=modelDesc))
+        self.streamed[df_ident] = (classes, dict(zip(descs, counts)), support)
+        self.log(f"Finished streamed evaluation of {df_ident}")
+
+    def UpdateModels(self, file_path, chunksize = None):
+        '''
+        Fold the labelled rows of a csv file into the models that support it (Model.partial_fit(df), the Naive Bayes and KMEANS models)
+        and save the ModelBuilder object again\n
+        The rows are encoded with the preprocessors of the original training data and read chunksize rows at a time if given
+        '''
+        models = [modelObj for modelObj in self.models if hasattr(modelObj, "partial_fit")]
+        self.log(f"Updating {len(models)} models with {file_path}")
+        chunks = ReadCSV(file_path, self.struct_file, chunksize) if chunksize is not None else [self.ReadCSV(file_path)]
+        total = 0
+        for chunk in chunks:
+            encoded = {key: self.preprocessors[key[0]].transform(chunk, key[1]) for key in dict.fromkeys(map(self.EncodingKey, models))}
+            for modelObj in models:
+                modelObj.partial_fit(encoded[self.EncodingKey(modelObj)])
+            total += len(chunk)
+            self.log(f"Folded {total} rows into the models")
+        for modelObj in models:
+            self.log(f"Updated {modelObj.description}")
+
+        builder_path = self.GetPath("ModelBuilder.joblib")
+        self.log(f"Saving ModelBuilder object to {builder_path}")
+        if self.gui_exists:
+            self.gui.done()
+        self.gui, self.gui_exists = None, False
+        jb.dump(self, builder_path)
+
+    def RunModel(self, modelEntry, modelDisc, eval_sets, model_kwargs, variants = None):
+        '''Build a single model and evaluate it on every (df_ident, df, suffix, distinct) in eval_sets (see Deduplicate),\n
+           returns a list of (model object, list of evaluation results (see evaluate_df))\n
+           variants - list of PrunedParams values, their models are pruned from one model built with the loosest values'''
+        if variants is not None:
+            build_kwargs = dict(model_kwargs, **{param: min(values[param] for values in variants) for param in variants[0]})
+            self.log(f"Building {self.Describe(modelEntry, modelDisc, build_kwargs)} for pruning")
+            baseObj = self.CreateModel(modelEntry, modelDisc, **build_kwargs)
+            models = []
+            for values in variants:
+                kwargs = dict(model_kwargs, **values)
+                models.append((baseObj.pruned(**{param: kwargs[param] for param in self.PrunedParams[modelEntry]}), kwargs))
+        else:
+            models = [(None, model_kwargs)]
+        outputs = []
+        for modelObj, kwargs in models:
+            modelDesc = self.Describe(modelEntry, modelDisc, kwargs)
+            self.log(f"Building {modelDesc}")
+            modelObj = self.CreateModel(modelEntry, modelDisc, **kwargs) if modelObj is None else modelObj
+            modelObj.description, modelObj.disc = modelDesc, modelDisc # Have this saved for __iter__
+            self.log(f"Finished building {modelDesc}")
+            # Evaluate data
+            results = [self.evaluate_df(df, modelObj, f"{modelDesc}, {suffix}", df_ident, distinct)
+                       for df_ident, df, suffix, distinct in eval_sets]
+            outputs.append((modelObj, results))
+        return outputs
+
+    def AddModelResults(self, modelObj, results):
+        for df_ident, modelDesc, specifics, info in results:
+            self.specifics[df_ident][modelDesc] = specifics
+            # Send Result to relevant GUI
+            if self.gui_exists:
+                self.gui.addRow(pd.Series(info, name=modelDesc))
+        # Keep object
+        self.models.append(modelObj)
+
+    def JobCopy(self, modelDisc):
+        '''Shallow copy of the builder with only what a model job of modelDisc needs, logs are buffered'''
+        builder = copy.copy(self)
+        builder.gui, builder.gui_exists, builder.memory, builder.CleanDataFrame = None, False, None, None
+        builder.models, builder.specifics, builder.log_buffer = [], dict(), []
+        builder.dataframes = {modelDisc: self.dataframes[modelDisc]}
+        builder.preprocessors = {modelDisc: self.preprocessors[modelDisc]}
+        builder.data_hashes = {modelDisc: self.data_hashes[modelDisc]} if modelDisc in self.data_hashes else dict()
+        return builder
+
+    def SavePreprocessor(self, modelDisc):
+        '''Save the fitted preprocessor of modelDisc next to the models (if joblib is enabled)'''
+        if self.jb_status != "enable":
+            return
+        if not os.path.isdir(self.GetPath("models")):
+            os.mkdir(self.GetPath("models"))
+        file_path = self.GetPath(f"models/Preprocessor, {modelDisc} disc.joblib")
+        jb.dump(self.preprocessors[modelDisc], file_path)
+        self.log(f"Saved {modelDisc} disc preprocessor to joblib file.")
+
+    def ProcessedPath(self, modelDisc, key):
+        return self.GetPath(f"Training file processed using {modelDisc} disc - {key}")
+
+    def SaveProcessed(self, df, modelDisc, key):
+        '''
+        Save the processed training data of modelDisc as categorical codes (see PDUtils.SaveCodes) with its preprocessor,
+        in a folder named by the key of the data and settings it was processed from, and reload it from there (memory mapped),
+        so the models and the worker processes share the saved codes instead of copies of the data.
+        The data is only saved with joblib enabled, it is kept in memory otherwise
+        '''
+        if self.jb_status != "enable":
+            self.dataframes[modelDisc] = df
+            return
+        dir_path = self.ProcessedPath(modelDisc, key)
+        SaveCodes(df, dir_path)
+        # Written last, a folder without it is not complete
+        ReplaceFile(path.join(dir_path, "preprocessor.joblib"), lambda file: jb.dump((key, self.preprocessors[modelDisc]), file))
+        self.dataframes[modelDisc] = LoadCodes(dir_path)
+
+    def LoadProcessed(self, modelDisc, key):
+        '''Load the saved processed training data of modelDisc if it was processed with the same key, returns whether it was loaded'''
+        dir_path = self.ProcessedPath(modelDisc, key)
+        file_path = path.join(dir_path, "preprocessor.joblib")
+        if not path.isfile(file_path):
+            return False
+        saved_key, preprocessor = jb.load(file_path)
+        if saved_key != key:
+            return False
+        self.dataframes[modelDisc], self.preprocessors[modelDisc] = LoadCodes(dir_path), preprocessor
+        self.log(f"Loaded the processed training data of {modelDisc} discretization from {dir_path}")
+        return True
+
+    @classmethod
+    def ModelClass(cls, modelEntry):
+        '''The model class of modelEntry (see ModelTypes), its module is imported on the first call'''
+        module, name = cls.ModelTypes[modelEntry]
+        return getattr(import_module(module), name)
+
+    @staticmethod
+    def StrictEncoding(model):
+        '''True if the data sets of the model class or object are transformed with strict=True (see Preprocessor.transform)'''
+        return getattr(model, "STRICT_ENCODING", False)
+
+    @classmethod
+    def EncodingKey(cls, modelObj):
+        '''(disc, strict encoding) of a built model, the encoded data sets of the models with the same key are shared'''
+        return modelObj.disc, cls.StrictEncoding(modelObj)
+
+    def CacheKey(self, modelEntry, modelDisc, **kwargs):
+        '''Hash of the processed training data, the model type and the hyperparameters the model type uses'''
+        params = {param: kwargs[param] for param in self.ModelParams[modelEntry] if param in kwargs}
+        return jb.hash((modelEntry, self.data_hashes[modelDisc], params))
+
+    def Describe(self, modelEntry, modelDisc, model_kwargs):
+        '''Model description, followed by the values of the swept parameters the model type uses'''
+        params = [f"{param}={model_kwargs[param]}" for param in self.ModelParams[modelEntry] if param in self.swept]
+        return ", ".join([modelEntry.format(modelDisc)] + params)
+
     def CreateModel(self, modelEntry, modelDisc, **kwargs):
-        modelDesc = modelEntry.format(modelDisc)
+        modelDesc = self.Describe(modelEntry, modelDisc, kwargs)
         if self.jb_status != "enable":
-            return self.ModelTypes[modelEntry](self.dataframes[modelDisc], **kwargs)
+            return self.ModelClass(modelEntry)(self.dataframes[modelDisc], **kwargs)
         if not os.path.isdir(self.GetPath("models")):
             os.mkdir(self.GetPath("models"))
-        file_path = self.GetPath(f"models/{modelDesc}.joblib")
+        # Models are only reused if they were built from the same data with the same parameters
+        file_path = self.GetPath(f"models/{modelDesc} - {self.CacheKey(modelEntry, modelDisc, **kwargs)}.joblib")
         try:
             # Check if model already exists
             model = jb.load(file_path)
+            os.utime(file_path) # Mark as recently used
             self.log(f"Loaded model {modelDesc} from joblib file.")
         except Exception:
-            model = self.ModelTypes[modelEntry](self.dataframes[modelDisc], **kwargs)
+            model = self.ModelClass(modelEntry)(self.dataframes[modelDisc], **kwargs)
             jb.dump(model, file_path)
             self.log(f"Saved model {modelDesc} to joblib file.")
-        model.description = modelDesc # Have this saved for __iter__
         return model
 
-    def evaluate_df(self, df, modelObj, modelDesc):
+    def EvictModelCache(self):
+        '''Remove the least recently used cached models until the cache fits in cache_size MB'''
+        cache_dir = self.GetPath("models")
+        if self.jb_status != "enable" or not os.path.isdir(cache_dir):
+            return
+        # Only the content-hashed model files are part of the cache (not the preprocessors)
+        entries = []
+        for fname in os.listdir(cache_dir):
+            if re.search(r" - [0-9a-f]{32}\.joblib$", fname):
+                stat = os.stat(os.path.join(cache_dir, fname))
+                entries.append((stat.st_mtime, stat.st_size, fname))
+        total, limit = sum(entry[1] for entry in entries), self.cache_size * 1024 * 1024
+        for _, size, fname in sorted(entries):
+            if total <= limit:
+                break
+            os.remove(os.path.join(cache_dir, fname))
+            total -= size
+            self.log(f"Evicted {fname} from the model cache.")
+
+    def Deduplicate(self, df, df_desc):
+        '''Group the rows of df by their feature values (see DistinctRows) and log how many distinct rows there are'''
+        rows, groups = DistinctRows(df.drop(labels=["class"], axis=1, errors="ignore"))
+        self.log(f"{df_desc}: {len(df)} rows, {len(rows)} distinct" + (f" (dedup ratio {len(df) / len(rows):.2f})" if len(rows) > 0 else ""))
+        return rows, groups
+
+    def evaluate_df(self, df, modelObj, modelDesc, df_ident = None, distinct = None):
+        '''Evaluate the model on every row of df, returns (df_ident, modelDesc, per sample results, info)\n
+           The model only scores each distinct row once, distinct - (rows, groups) of df if already known (see Deduplicate)'''
         self.log(f"Starting evaluation of {modelDesc}")
-        df_ident = df.ident
-        df = df.applymap(lambda x: x.lower() if type(x) == str else x)
+        df_ident = df.ident if df_ident is None else df_ident
+        df = LowerStrings(df)
         info = {"Total Entries": len(df), "Correct": 0, "Errors": 0, "Error %": 0}
-        
-        specifics = pd.Series(index=range(len(df)), name=modelDesc, dtype=object)
-        for idx, row in df.iterrows():
-            result = specifics[idx] = modelObj.evaluate(row)
-            if result is None or result != row["class"]:
-                info["Errors"] += 1
-            else:
-                info["Correct"] += 1
-
-        self.specifics[df_ident][modelDesc] = specifics
+
+        rows, groups = self.Deduplicate(df, df_ident) if distinct is None else distinct
+        predictions = np.asarray(modelObj.predict_batch(df.iloc[rows]), dtype=object)
+        specifics = pd.Series(predictions[groups], index=range(len(df)), name=modelDesc, dtype=object)
+        # None results never match the class column, so they are counted as errors
+        info["Correct"] = int((specifics.values == df["class"].values).sum())
+        info["Errors"] = len(df) - info["Correct"]
+
         info["Error %"] = format((info["Errors"] / len(df)) * 100, '.2f')
         self.log(", ".join([f"{key}: {info[key]}" for key in info]))
         self.log(f"Finished evaluation of {modelDesc}")
-        # Send Result to relevant GUI
-        if self.gui_exists:
-            self.gui.addRow(pd.Series(info, name=modelDesc))
+        return df_ident, modelDesc, specifics, info
+
+    def ReadCSV(self, file_path):
+        '''Read a whole csv data set with the column types of the structure file (see PDUtils.ReadCSV), logs the load time and memory'''
+        start = perf_counter()
+        df = ReadCSV(file_path, self.struct_file)
+        self.log(f"Loaded {path.basename(file_path)} ({len(df)} rows, {df.memory_usage(deep=True).sum() / 2**20:.1f} MB) "
+                 f"in {perf_counter() - start:.2f} seconds")
+        return df
 
     def log(self, line):
-        if self.gui_exists:
+        if self.log_buffer is not None:
+            self.log_buffer.append(line)
+        elif self.gui_exists:
             self.gui.logLine(line)
     def __iter__(self):
         return iter(self.models)
     # Trade compute time for harddrive space
-    def memoize(self, func):
+    def memoize(self, func, ignore = None):
         if self.jb_status not in ["enable", "purge"]:
             return func
         if self.memory is None:
@@ -197,7 +552,7 @@ class ModelBuilder:
             if self.jb_status == "purge":
                 self.memory.clear(warn=False)
                 self.jb_status = "enable" # Prevent purge on every call
-        return self.memory.cache(func)
+        return self.memory.cache(func, ignore=ignore)
     def GetPath(self, fname):
         return os.path.join(self.write_dir, fname)
     def TagDataFrame(self, df, ident):  
@@ -3,70 +3,95 @@
 # Dor Rozenhak
 # Roi Amzallag
 
+import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype
-from functools import reduce
 import Utilities.PDUtils as utils
 
 class Type1Bayes:
-    "Self implemented Naive Bayes Classifier Model"
+    '''
+    Self implemented Naive Bayes Classifier Model\n
+    Keeps a class x category count array per attribute (and the class counts), all starting at 1 as laplacian correction,
+    and scores in log space with log probability tables that are calculated from the counts
+    '''
+    # Numeric values outside of every interval are ignored like unknown values, so the data sets of the model
+    # are transformed with Preprocessor.transform(df, strict=True) (see ModelBuilder.StrictEncoding)
+    STRICT_ENCODING = True
     def __init__(self, df, **kwargs):
-        # Dictionaries to store models and memoized calculations
-        self.probTables, self.len_cache, self.prob_cache = dict(), dict(), dict()
+        x = df.drop(labels="class", axis=1)
         self.classes = df["class"].unique()
-
+        # Category values of every attribute, the counts are kept by category position
+        self.categories = dict()
         if "encoder" not in kwargs or kwargs["encoder"] is None:
-            for col in df:
-                if col == "class":
-                    continue
-                self.probTables[col] = self.parseColumn(df, col)
+            for col in x:
+                self.categories[col] = pd.Index(np.asarray(x[col].unique()))
         else:
-            for col, categories in zip(df, kwargs["encoder"].categories_):
-                if col == "class":
-                    continue
-                self.probTables[col] = self.parseColumn(df, col, categories)
+            for col, categories in zip(x, kwargs["encoder"].categories_):
+                self.categories[col] = pd.Index(categories)
+        # Category value -> position of every attribute, for encoding single rows (see evaluate)
+        self.category_codes = {col: {category: code for code, category in enumerate(categories)}
+                               for col, categories in self.categories.items()}
 
-        self.probTables["class"] = pd.DataFrame(1, columns=["value"], index=self.classes)
-        for class_value in df["class"]:
-            self.probTables["class"].at[class_value, "value"] += 1
+        # Interval lookups are shared between models of the same discretization if given
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = utils.BuildIntervalLookups(x, list(self.categories.values()))
+        else:
+            self.lookups = kwargs["lookups"]
+        # Category code remaps of the categorical columns this model encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
 
-    # df should have been processed by CleanDataFrame
-    def parseColumn(self, df, col_name, categories = None):
         # put 1 as a default value as laplacian correction
-        if categories is not None:
-            result = pd.DataFrame(1, columns=categories, index=self.classes)
-        else:
-            result = pd.DataFrame(1, columns=df[col_name].unique(), index=self.classes)
-        for class_value, col_value in zip(df["class"], df[col_name]):
-            result.at[class_value, col_value] += 1
-        return result
+        self.class_counts = np.ones(len(self.classes), dtype=np.int64)
+        self.counts = {col: np.ones((len(self.classes), len(categories)), dtype=np.int64)
+                       for col, categories in self.categories.items()}
+        self.addCounts(df)
 
-    def probabilityOf(self, table, a, b=None):
-        # Use the caches to avoid wasting time on recalculating already calculated values
-        if (table, a, b) not in self.prob_cache:
-            if table not in self.len_cache:
-                self.len_cache[table] = sum([sum(self.probTables[table][col]) for col in self.probTables[table]])
-            try:
-                if b is None:
-                    self.prob_cache[(table, a, b)] = sum(self.probTables[table].loc[a]) / self.len_cache[table]
-                else:
-                    self.prob_cache[(table, a, b)] = (self.probTables[table].loc[b, a] / self.len_cache[table]) / self.probabilityOf(table, b)
-            except Exception:
-                self.prob_cache[(table, a, b)] = 1
-        return self.prob_cache[(table, a, b)]
+    def partial_fit(self, df):
+        '''Fold the labelled rows of df into the model (cost depends only on len(df)),
+           rows with class values that were not in the training data are skipped'''
+        self.addCounts(df)
+        return self
+
+    # df should have been processed by CleanDataFrame
+    def addCounts(self, df):
+        '''Add the class and class x category counts of the rows of df and update the log probability tables'''
+        class_codes = pd.Index(self.classes).get_indexer(df["class"])
+        known = class_codes >= 0
+        self.class_counts += np.bincount(class_codes[known], minlength=len(self.classes))
+        codes = utils.EncodeDataFrame(df[list(self.categories)], list(self.categories.values()), self.lookups, self.remaps, strict=True)
+        for idx, (col, counts) in enumerate(self.counts.items()):
+            # Unknown values are not counted
+            valid = known & (codes[:, idx] >= 0)
+            np.add.at(counts, (class_codes[valid], codes[valid, idx]), 1)
+        self.updateTables()
+
+    def updateTables(self):
+        '''
+        Calculate the log probability tables from the counts\n
+        log_prior[class] - log P(class)\n
+        log_likelihoods[attribute][category, class] - log P(category | class),
+        with an extra row of zeros for unknown values (code -1) so they do not affect the result
+        '''
+        self.log_prior = np.log(self.class_counts / self.class_counts.sum())
+        self.log_likelihoods = dict()
+        for col, counts in self.counts.items():
+            table = np.log(counts / counts.sum(axis=1, keepdims=True)).T
+            self.log_likelihoods[col] = np.vstack([table, np.zeros((1, len(self.classes)))])
 
     # Row eval function
     def evaluate(self, row):
-        probabilities = {c: self.probabilityOf("class", c) for c in self.classes}
-        for key in row.index:
-            if key == "class":
-                continue
-            if row[key] not in self.probTables[key] and is_numeric_dtype(row[key]):
-                # Find the column that fits the row value
-                col = utils.FindBestInterval(row[key], self.probTables[key])
-            else:
-                col = row[key]
-            for c in self.classes:
-                probabilities[c] *= self.probabilityOf(key, col, c)
-        # find class with highest probability and return it
-        return reduce(lambda a, b: a if probabilities[a] > probabilities[b] else b, probabilities)
+        scores = self.log_prior.copy()
+        for col in self.categories:
+            code = utils.EncodeValue(row[col], self.category_codes[col], self.lookups.get(col), strict=True)
+            scores += self.log_likelihoods[col][code]
+        # Ties are broken in favor of the last class
+        return self.classes[len(self.classes) - 1 - np.argmax(scores[::-1])]
+
+    def predict_batch(self, df):
+        '''Classify all the rows of df at once, with one gather and sum of the log probabilities per attribute,
+           numeric values outside of every interval and missing values are ignored like unknown categories'''
+        codes = utils.EncodeDataFrame(df[list(self.categories)], list(self.categories.values()), self.lookups, self.remaps, strict=True)
+        scores = np.tile(self.log_prior, (len(codes), 1))
+        for idx, col in enumerate(self.categories):
+            scores += self.log_likelihoods[col][codes[:, idx]]
+        # Ties are broken in favor of the last class
+        return self.classes[len(self.classes) - 1 - np.argmax(scores[:, ::-1], axis=1)]
@@ -3,17 +3,108 @@
 # Dor Rozenhak
 # Roi Amzallag
 
+import math
+import copy
 from functools import reduce
+import numpy as np
+import pandas as pd
 import Utilities.PDUtils as utils
 
 # Authors: Baruch Rutman and Roi Amzallag
 # Imported lab5 ID3 tree builder
 
+class ID3Builder:
+    '''
+    Tree builder engine for Type1ID3Tree\n
+    Integer encodes the data set once, every node then works on an array of row indexes
+    and calculates its gains from attribute x class count tables made with np.bincount.
+    Gives the exact same results as utils.Gain and utils.Entropy
+    '''
+    def __init__(self, df):
+        self.columns = list(df.columns)
+        self.codes, self.values, self.sorted_codes, self.quirks = dict(), dict(), dict(), dict()
+        self.classes, self.class_values = pd.factorize(df["class"])
+        self.class_count = len(self.class_values)
+        class_positions = {value: pos for pos, value in enumerate(self.class_values)}
+        # Rank of every class value when sorted, groupby value_counts breaks count ties with it
+        self.class_ranks = np.argsort(np.argsort(np.array(self.class_values, dtype=object)))
+        for attr in self.columns:
+            if attr == "class":
+                continue
+            self.codes[attr], self.values[attr] = pd.factorize(df[attr])
+            # Same order as the groupby in utils.Gain
+            self.sorted_codes[attr] = sorted(range(len(self.values[attr])), key=lambda code: self.values[attr][code])
+            # utils.Gain matches the (attribute value, class) combinations with "entry in combination",
+            # so attribute values that are equal to a class value also pick up that class from the other values
+            self.quirks[attr] = {code: class_positions[value] for code, value in enumerate(self.values[attr])
+                                 if isinstance(value, str) and value in class_positions}
+
+    @staticmethod
+    def entropy(codes, minlength):
+        '''Same as utils.Entropy for integer codes, sums in order of appearance to get the exact same value'''
+        counts = np.bincount(codes, minlength=minlength)
+        _, first_seen = np.unique(codes, return_index=True)
+        total = len(codes)
+        return -(sum([(counts[code] / total) * math.log2(counts[code] / total) for code in codes[np.sort(first_seen)]]))
+
+    def classResult(self, rows):
+        '''Returns the most common class value of the rows and the amount of different class values'''
+        counts = np.bincount(self.classes[rows], minlength=self.class_count)
+        if (counts == counts.max()).sum() > 1:
+            # Break ties the same way pandas does
+            return pd.Series(self.class_values[self.classes[rows]]).value_counts().idxmax(), (counts > 0).sum()
+        return self.class_values[counts.argmax()], (counts > 0).sum()
+
+    def gains(self, rows, attrs):
+        '''Returns the gain ratio (utils.Gain / utils.Entropy) of every attribute for the given rows'''
+        classes, total = self.classes[rows], len(rows)
+        class_entropy = self.entropy(classes, self.class_count)
+        gains = dict()
+        for attr in attrs:
+            codes = self.codes[attr][rows]
+            split_entropy = self.entropy(codes, len(self.values[attr]))
+            if split_entropy == 0:
+                gains[attr] = 0
+                continue
+            # Attribute x class contingency table
+            table = np.bincount(codes * self.class_count + classes,
+                                minlength=len(self.values[attr]) * self.class_count).reshape(-1, self.class_count)
+            attr_counts = table.sum(axis=1)
+            present = [code for code in self.sorted_codes[attr] if attr_counts[code] > 0]
+            # p * log2(p) of every combination, in the order of groupby(attr)["class"].value_counts()
+            terms = dict()
+            for code in present:
+                row_classes = sorted(np.flatnonzero(table[code]), key=lambda c: (-table[code, c], self.class_ranks[c]))
+                terms[code] = [(c, (table[code, c] / attr_counts[code]) * math.log2(table[code, c] / attr_counts[code]))
+                               for c in row_classes]
+            result = class_entropy
+            for entry in present:
+                entropy = 0
+                quirk_class = self.quirks[attr].get(entry)
+                for code in present:
+                    for c, term in terms[code]:
+                        if code == entry or c == quirk_class:
+                            entropy += term
+                result += (attr_counts[entry] / total) * entropy
+            gains[attr] = result / split_entropy
+        return gains
+
+    def partition(self, rows, attr):
+        '''Split the rows by their attr value, returns a list of (value, rows) in order of appearance'''
+        codes = self.codes[attr][rows]
+        order = np.argsort(codes, kind="stable")
+        uniques, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+        first_seen = order[starts] # Position of the first row of every value
+        return [(self.values[attr][uniques[idx]], rows[order[starts[idx]:starts[idx] + counts[idx]]])
+                for idx in np.argsort(first_seen)]
+
 class Type1ID3Tree:
     '''
     Self implemented ID3 Tree Model\n
     ID3 Decision tree class\n
-    Built as a recursive tree with the leaves being one of the possible class results
+    Built as a recursive tree with the leaves being one of the possible class results\n
+    Every node also keeps its unpruned split (nodeClass, nodeAttr, gain, samples, branches),
+    so trees for stricter min_gain/leaf_limit values can be derived with pruned()
     '''
     # Minimum info gain value, to not over fit the model, usually 0.3
     MIN_GAIN = 0.3
@@ -23,11 +114,12 @@ class Type1ID3Tree:
         df - df is assumed to be a pandas.DataFrame object, might have bugs if not\n
         leaf_limit - set so to not have more branching if len(df) <= leaf_limit\n
         skip_attrs - list of attributes that are not be evaluated for InfoGain\n
-        min_gain - minimum amount of InfoGain for branching, default is 0.3  
+        min_gain - minimum amount of InfoGain for branching, default is 0.3\n
+        builder, rows - used internally to build sub trees from the rows of the root data set (df is None)
         '''
         leaf_limit = 0 if "leaf_limit" not in kwargs else kwargs["leaf_limit"]
         skip_attrs = ["class"] if "skip_attrs" not in kwargs else kwargs["skip_attrs"]
-        min_gain = MIN_GAIN if "min_gain" not in kwargs else kwargs["min_gain"]
+        min_gain = Type1ID3Tree.MIN_GAIN if "min_gain" not in kwargs else kwargs["min_gain"]
 
         # Save the structure for use later in evaluation
         if "attr_dict" not in kwargs:
@@ -41,50 +133,158 @@ class Type1ID3Tree:
                     self.attr_dict[attr] = sorted(temp_df[attr].unique())
         else:
             self.attr_dict = kwargs["attr_dict"]
+        # Interval lookups are shared between all the nodes (and models of the same discretization if given)
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = utils.BuildIntervalLookups(df.drop(labels="class", axis=1), list(self.attr_dict.values()))
+        else:
+            self.lookups = kwargs["lookups"]
+
+        # The builder engine is created once by the root node and shared with all the sub trees
+        if "builder" not in kwargs:
+            builder, rows = ID3Builder(df), np.arange(len(df))
+        else:
+            builder, rows = kwargs["builder"], kwargs["rows"]
 
         self.subTrees, self.rootAttr = None, None
+        # CompiledID3Tree of the tree, built on the first prediction (see compile)
+        self.compiled = None
+        # Thresholds this node was built with, pruned() can only make them stricter
+        self.limits = (min_gain, leaf_limit)
+        # Unpruned split of this node, gain stays None if no attribute was evaluated
+        self.nodeAttr, self.gain, self.samples, self.branches = None, None, len(rows), None
         # Set most common class value for this sub tree
-        val_counts = df["class"].value_counts()
-        self.classResult = val_counts.idxmax()
+        self.classResult, class_count = builder.classResult(rows)
+        self.nodeClass = self.classResult
         # Filter out attributes that are to be skipped
-        attrs = [attr for attr in df if attr not in skip_attrs]
+        attrs = [attr for attr in builder.columns if attr not in skip_attrs]
         # Check if there attrs to work with or check if data len is below the set threshhold
-        if len(attrs) == 0 or (leaf_limit > 0 and len(df) < leaf_limit) or len(val_counts) <= 1:
+        if len(attrs) == 0 or (leaf_limit > 0 and len(rows) < leaf_limit) or class_count <= 1:
             return
-        # Calculate the gain for each attribute
-        #gains = {attr: utils.Gain(df, attr) for attr in attrs}
-        # FIXME Maybe this instead?
-        gains = dict()
-        for attr in attrs:
-            gains[attr] = 0
-            entropy = utils.Entropy(df[attr])
-            if entropy != 0:
-                gains[attr] = utils.Gain(df,attr) / entropy
+        # Calculate the gain ratio for each attribute
+        gains = builder.gains(rows, attrs)
         # Pick the attribute to branch on
         self.rootAttr = reduce(lambda a, b: a if gains[a] > gains[b] else b, gains)
+        self.nodeAttr, self.gain = self.rootAttr, gains[self.rootAttr]
         # Check if the highest is below the set threshhold
         if gains[self.rootAttr] <= min_gain:
             return
-        self.subTrees, unique_values = dict(), df[self.rootAttr].unique()
-        for entry in unique_values:
+        self.branches = dict()
+        for entry, entry_rows in builder.partition(rows, self.rootAttr):
             # Branch and take only the relevant rows (divide and conquer)
-            self.subTrees[entry] = Type1ID3Tree(df[df[self.rootAttr] == entry],
+            self.branches[entry] = Type1ID3Tree(None,
+                                                builder = builder,
+                                                rows = entry_rows,
                                                 leaf_limit = leaf_limit,
                                                 skip_attrs = skip_attrs + [self.rootAttr],
                                                 min_gain = min_gain,
-                                                attr_dict = self.attr_dict)
+                                                attr_dict = self.attr_dict,
+                                                lookups = self.lookups)
+        self.subTrees = self.branches
         if len(self.subTrees) == 1:
             # Pruning
             subTree = self.subTrees[list(self.subTrees.keys())[0]]
             self.classResult, self.rootAttr, self.subTrees = subTree.classResult, subTree.rootAttr, subTree.subTrees
+    def pruned(self, min_gain = None, leaf_limit = 0):
+        '''
+        Returns a copy of the tree as if it was built with the given min_gain and leaf_limit,
+        without going over the data again\n
+        The values must be at least as strict as the ones the tree was built with
+        (build once with min_gain=0 and leaf_limit=0 to derive any tree)
+        '''
+        min_gain = Type1ID3Tree.MIN_GAIN if min_gain is None else min_gain
+        built_gain, built_leaf_limit = self.limits
+        if min_gain < built_gain or (built_leaf_limit > 0 and not 0 < built_leaf_limit <= leaf_limit):
+            raise ValueError(f"Can't prune a tree built with min_gain={built_gain}, leaf_limit={built_leaf_limit} "
+                             f"to min_gain={min_gain}, leaf_limit={leaf_limit}")
+        # Shallow copy, the attribute structure, lookups and the unpruned branches are shared
+        tree = copy.copy(self)
+        tree.limits, tree.compiled = (min_gain, leaf_limit), None
+        tree.classResult, tree.rootAttr, tree.subTrees = self.nodeClass, self.nodeAttr, None
+        # Same checks as in the constructor
+        if self.gain is None or (leaf_limit > 0 and self.samples < leaf_limit):
+            tree.rootAttr = None
+            return tree
+        if self.gain <= min_gain:
+            return tree
+        tree.subTrees = {entry: branch.pruned(min_gain, leaf_limit) for entry, branch in self.branches.items()}
+        if len(tree.subTrees) == 1:
+            # Pruning
+            subTree = tree.subTrees[list(tree.subTrees.keys())[0]]
+            tree.classResult, tree.rootAttr, tree.subTrees = subTree.classResult, subTree.rootAttr, subTree.subTrees
+        return tree
     # Row eval function
     def evaluate(self, row, first_call = True):
         if first_call: # Reform row according to training set structure
             row = row.drop(labels=["class"])
             for label in row.index:
-                if utils.IsInterval(self.attr_dict[label][0]):
-                    row[label] = utils.FindBestInterval(row[label], self.attr_dict[label])
+                if label in self.lookups:
+                    row[label] = self.lookups[label].find(row[label])
         if self.subTrees is not None and row[self.rootAttr] in self.subTrees:
             return self.subTrees[row[self.rootAttr]].evaluate(row, first_call = False)
         # return most common class value
         return self.classResult
+    def predict_batch(self, df):
+        "Classify all the rows of df at once (with the compiled version of the tree)"
+        return self.compile().predict_batch(df)
+    def compile(self):
+        '''Returns a CompiledID3Tree, a flat array version of the tree for fast inference and smaller files,
+           it is built once and kept with the tree (but not saved with it)'''
+        if self.compiled is None:
+            self.compiled = CompiledID3Tree(self)
+        return self.compiled
+    def __getstate__(self):
+        # The compiled tree is built again on the first prediction after loading
+        state = self.__dict__.copy()
+        state["compiled"] = None
+        return state
+
+class CompiledID3Tree:
+    '''
+    Flat array version of a Type1ID3Tree\n
+    Every node is an index into parallel arrays:\n
+    features[node] - column index of the node attribute, -1 for leaves\n
+    offsets[node] - start of the node children in children, which has a slot per category code of the attribute
+    (-1 if that value has no sub tree)\n
+    node_class[node] - index of the most common class value of the node in classes
+    '''
+    def __init__(self, tree):
+        self.columns, self.attr_dict, self.lookups = list(tree.attr_dict), tree.attr_dict, tree.lookups
+        # Category code remaps of the categorical columns this tree encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
+        columns = {attr: idx for idx, attr in enumerate(self.columns)}
+        classes, nodes, features, offsets, node_class, children = dict(), [tree], [], [], [], []
+        # Breadth first numbering, a node children are numbered when the node is reached
+        for node in nodes:
+            node_class.append(classes.setdefault(node.classResult, len(classes)))
+            if node.subTrees is None:
+                features.append(-1)
+                offsets.append(0)
+                continue
+            categories = list(self.attr_dict[node.rootAttr])
+            features.append(columns[node.rootAttr])
+            offsets.append(len(children))
+            slots = [-1] * len(categories)
+            for entry, subTree in node.subTrees.items():
+                slots[categories.index(entry)] = len(nodes)
+                nodes.append(subTree)
+            children += slots
+        self.classes = np.array(list(classes), dtype=object)
+        self.features = np.array(features, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int32)
+        self.node_class = np.array(node_class, dtype=np.int32)
+        self.children = np.array(children, dtype=np.int32)
+    def predict_batch(self, df):
+        "Classify all the rows of df at once, all the rows go down the tree one level per iteration"
+        codes = utils.EncodeDataFrame(df[self.columns], [self.attr_dict[attr] for attr in self.columns], self.lookups, self.remaps)
+        nodes, active = np.zeros(len(codes), dtype=np.int32), np.arange(len(codes))
+        while len(active) > 0:
+            features = self.features[nodes[active]]
+            active = active[features >= 0]
+            values = codes[active, features[features >= 0]]
+            # Unknown values (-1) and values without a sub tree stop at the current node
+            children = np.where(values >= 0, self.children[self.offsets[nodes[active]] + values], -1)
+            active = active[children >= 0]
+            nodes[active] = children[children >= 0]
+        return self.classes[self.node_class[nodes]]
+    def evaluate(self, row):
+        return self.predict_batch(row.to_frame().T)[0]
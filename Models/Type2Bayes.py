@@ -4,9 +4,10 @@
 # Roi Amzallag
 
 from functools import reduce
+import numpy as np
 from sklearn.naive_bayes import CategoricalNB
 from sklearn.preprocessing import OrdinalEncoder
-from Utilities.PDUtils import FindBestInterval, IsInterval, SplitXY
+from Utilities.PDUtils import SplitXY, EncodeDataFrame, BuildIntervalLookups
 
 # Roi's responsibility
 class Type2Bayes:
@@ -17,15 +18,43 @@ class Type2Bayes:
             self.encoder = OrdinalEncoder().fit(x)
         else:
             self.encoder = kwargs["encoder"]
+        # Interval lookups are shared between models of the same discretization if given
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = BuildIntervalLookups(x, self.encoder.categories_)
+        else:
+            self.lookups = kwargs["lookups"]
+        # Category code remaps of the categorical columns this model encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
         self.model = CategoricalNB()
-        self.model.fit(self.encoder.transform(x), y)
+        self.model.fit(EncodeDataFrame(x, self.encoder.categories_, self.lookups), y)
+    def partial_fit(self, df):
+        "Fold the labelled rows of df into the model, rows with unknown values or class values are skipped"
+        x, y = SplitXY(df)
+        codes = EncodeDataFrame(x, self.encoder.categories_, self.lookups, self.remaps)
+        known = (codes >= 0).all(axis=1) & np.isin(y, self.model.classes_)
+        if known.any():
+            self.model.partial_fit(codes[known], y[known])
+            # partial_fit grows the count tables for new category codes but not n_categories_
+            self.model.n_categories_ = np.array([counts.shape[1] for counts in self.model.category_count_])
+        return self
     def evaluate(self, row):
         row = row.drop(labels=["class"])
-        for label, intervals in zip(row.index, self.encoder.categories_):
-            if IsInterval(intervals[0]): 
-                row[label] = FindBestInterval(row[label], intervals)
+        for label in row.index:
+            if label in self.lookups:
+                row[label] = self.lookups[label].find(row[label])
         try:
             return self.model.predict(self.encoder.transform([row]))[0]
         except Exception:
-            # return most common class
-            return reduce(lambda x, y: x if x[1] > y[1] else y, zip(self.model.classes_, self.model.class_count_))[0]
+            return self.commonClass()
+    def predict_batch(self, df):
+        "Classify all the rows of df at once, rows with unknown values get the most common class"
+        codes = EncodeDataFrame(df.drop(labels=["class"], axis=1, errors="ignore"), self.encoder.categories_, self.lookups, self.remaps)
+        # Categories that never appeared in the training data are unknown to CategoricalNB as well
+        known = ((codes >= 0) & (codes < self.model.n_categories_)).all(axis=1)
+        results = np.full(len(codes), self.commonClass(), dtype=object)
+        if known.any():
+            results[known] = self.model.predict(codes[known])
+        return results
+    def commonClass(self):
+        # return most common class
+        return reduce(lambda x, y: x if x[1] > y[1] else y, zip(self.model.classes_, self.model.class_count_))[0]
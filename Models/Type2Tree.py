@@ -3,9 +3,10 @@
 # Dor Rozenhak
 # Roi Amzallag
 
+import numpy as np
 from sklearn.preprocessing import OrdinalEncoder
 from sklearn.tree import DecisionTreeClassifier
-from Utilities.PDUtils import SplitXY, IsInterval, FindBestInterval
+from Utilities.PDUtils import SplitXY, EncodeDataFrame, BuildIntervalLookups
 
 class Type2Tree:
     def __init__(self, df, **kwargs):
@@ -15,16 +16,32 @@ class Type2Tree:
             self.encoder = OrdinalEncoder().fit(x)
         else:
             self.encoder = kwargs["encoder"]
+        # Interval lookups are shared between models of the same discretization if given
+        if "lookups" not in kwargs or kwargs["lookups"] is None:
+            self.lookups = BuildIntervalLookups(x, self.encoder.categories_)
+        else:
+            self.lookups = kwargs["lookups"]
+        # Category code remaps of the categorical columns this model encodes, by column (see EncodeDataFrame)
+        self.remaps = dict()
         leaf_limit = 2 if "leaf_limit" not in kwargs or kwargs["leaf_limit"] < 2 else kwargs["leaf_limit"]
         self.model = DecisionTreeClassifier(criterion="entropy", min_samples_split=leaf_limit)
-        self.model.fit(self.encoder.transform(x), y)
+        self.model.fit(EncodeDataFrame(x, self.encoder.categories_, self.lookups), y)
 
     def evaluate(self, row):
         row = row.drop(labels=["class"])
-        for label, intervals in zip(row.index, self.encoder.categories_):
-            if IsInterval(intervals[0]):
-                row[label] = FindBestInterval(row[label], intervals)
+        for label in row.index:
+            if label in self.lookups:
+                row[label] = self.lookups[label].find(row[label])
         try:
             return self.model.predict(self.encoder.transform([row]))[0]
         except Exception:
             return self.common_class
+
+    def predict_batch(self, df):
+        "Classify all the rows of df at once, rows with unknown values get the most common class"
+        codes = EncodeDataFrame(df.drop(labels=["class"], axis=1, errors="ignore"), self.encoder.categories_, self.lookups, self.remaps)
+        known = (codes >= 0).all(axis=1)
+        results = np.full(len(codes), self.common_class, dtype=object)
+        if known.any():
+            results[known] = self.model.predict(codes[known])
+        return results
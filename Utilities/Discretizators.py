@@ -4,6 +4,7 @@
 # Roi Amzallag
 
 import math
+import numpy as np
 import pandas as pd
 
 # Returns the amount of bits required to encode the given data set most effciently
@@ -24,28 +25,54 @@ def CutpointEntropy(df, attr, cutpoint):
     len_s, len_s1, len_s2 = len(S), len(S1), len(S2)
     return (len_s1 / len_s) * Entropy(S1["class"]) + (len_s2 / len_s) * Entropy(S2["class"])
 
-# This function will always return an iterable, a list object for recursive calls, a pd.Series for main call
-def EntropyDisc(df, attr, levels, init=True):
-    if len(df) <= 1 or levels == 0:
-        return [] if init is False else df[attr]
+# Entropy of every row of a class count matrix, rows with a total of 0 have an entropy of 0
+def CountsEntropy(counts, totals):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        probs = counts / totals[:, None]
+        terms = np.where(counts > 0, probs * np.log2(probs), 0.0)
+    return -terms.sum(axis=1)
 
-    # Make a sorted copy to work with but only really sort if needed
-    df_orig, df = df, df.sort_values(by=[attr]) if init is True else df
-    # Make sure we will not have redundant calculations
-    unique_values = df[attr].unique()
-    if len(unique_values) <= 1: # HACK Dunno if this works
-        return [] if init is False else df[attr]
-    # This is the greedy part of the algorithm FIXME Try to reduce amount of calculations
-    entropies = pd.Series({value: CutpointEntropy(df, attr, value) for value in unique_values})
+# Finds the cutpoints of the sorted rows lo..hi (exclusive), same algorithm as the old DataFrame based version
+# values - sorted column values, cum - cumulative class counts (cum[i] counts the first i rows)
+# ends - exclusive end position of every unique value in values
+def EntropyCutpoints(values, cum, ends, lo, hi, levels):
+    if hi - lo <= 1 or levels == 0:
+        return []
+    # Every unique value in the range is a candidate cutpoint, S1 is lo..end and S2 is end..hi
+    candidates = ends[np.searchsorted(ends, lo, side="right"):np.searchsorted(ends, hi, side="right")]
+    if len(candidates) <= 1:
+        return []
+    len_s, len_s1 = hi - lo, candidates - lo
+    len_s2 = len_s - len_s1
+    counts_s1 = cum[candidates] - cum[lo]
+    counts_s2 = (cum[hi] - cum[lo]) - counts_s1
+    # E(A, T; S) for every candidate at once
+    entropies = (len_s1 / len_s) * CountsEntropy(counts_s1, len_s1) + (len_s2 / len_s) * CountsEntropy(counts_s2, len_s2)
     # https://www.saedsayad.com/supervised_binning.htm
-    cutpoint = entropies.idxmin() # Academic Paper said cut-point should be the lowest cutpoint entropy
+    split = candidates[np.argmin(entropies)] # Academic Paper said cut-point should be the lowest cutpoint entropy
+    return (EntropyCutpoints(values, cum, ends, lo, split, levels - 1) + [values[split - 1]] +
+            EntropyCutpoints(values, cum, ends, split, hi, levels - 1))
 
-    S1, S2 = df[df[attr] <= cutpoint], df[df[attr] > cutpoint]
-    cutpoints = EntropyDisc(S1, attr, levels - 1, False) + [cutpoint] + EntropyDisc(S2, attr, levels - 1, False)
+# Entropy based discretization, returns a pd.Series of intervals for the attr column
+# Sorts the column once and works on index ranges with prefix sums of the class counts,
+# so every candidate cutpoint entropy is calculated without filtering the DataFrame
+def EntropyDisc(df, attr, levels):
+    if len(df) <= 1 or levels == 0:
+        return df[attr]
+    values = df[attr].values
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    if sorted_values[0] == sorted_values[-1]:
+        return df[attr]
+    class_codes, classes = pd.factorize(df["class"].values[order])
+    # Missing classes get their own count column (code -1)
+    one_hot = np.zeros((len(values) + 1, len(classes) + 1), dtype=np.int64)
+    one_hot[np.arange(1, len(values) + 1), class_codes + 1] = 1
+    cum = one_hot.cumsum(axis=0)
+    ends = np.append(np.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1, len(values))
 
-    if init is not True:
-        return cutpoints
+    cutpoints = EntropyCutpoints(sorted_values, cum, ends, 0, len(values), levels)
     # Add maximum and minimum values so not to miss any values
-    cutpoints += [unique_values.min(), unique_values.max()]
+    cutpoints += [sorted_values[0], sorted_values[-1]]
     # Have pandas.cut to actually do the binning for us
-    return pd.cut(df_orig[attr], sorted(cutpoints), duplicates="drop", include_lowest=True)
+    return pd.cut(df[attr], sorted(cutpoints), duplicates="drop", include_lowest=True)
@@ -0,0 +1,67 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import numpy as np
+import pandas as pd
+
+__doc__ = '''Vectorized evaluation metrics (confusion matrices, error rate, precision, recall and F1) of many models at once'''
+
+def ConfusionMatrices(y_true, predictions, classes):
+    '''
+    Confusion matrices of every model in a single bincount over the (model, true class, predicted class) index\n
+    y_true - the class of every row\n
+    predictions - models x rows array (or list of arrays) of predicted classes\n
+    classes - class values of the matrix rows and columns,
+    pairs with a value that is not in classes (e.g. None predictions) are not counted, same as sklearn.metrics.confusion_matrix\n
+    returns models x classes x classes numpy.ndarray, [model, true class, predicted class] -> count
+    '''
+    index, class_count = pd.Index(classes), len(classes)
+    true_codes = index.get_indexer(np.asarray(y_true, dtype=object))
+    pred_codes = index.get_indexer(np.asarray(predictions, dtype=object).reshape(-1)).reshape(-1, len(true_codes))
+    flat = (np.arange(len(pred_codes))[:, None] * class_count + true_codes[None, :]) * class_count + pred_codes
+    valid = (true_codes[None, :] >= 0) & (pred_codes >= 0)
+    counts = np.bincount(flat[valid], minlength=len(pred_codes) * class_count * class_count)
+    return counts.reshape(len(pred_codes), class_count, class_count)
+
+def ClassSupport(y_true, classes):
+    '''Amount of rows of every class (in the order of classes)'''
+    codes = pd.Index(classes).get_indexer(np.asarray(y_true, dtype=object))
+    return np.bincount(codes[codes >= 0], minlength=len(classes))
+
+def ClassMetrics(matrices, support = None):
+    '''
+    Precision, recall and F1 of every class from confusion matrices (see ConfusionMatrices),
+    classes that are never predicted (or never seen) get 0 like sklearn.metrics with zero_division=0\n
+    support - amount of rows of every class (see ClassSupport), needed when some predictions are not in the matrices (e.g. None),
+    taken from the matrices if None\n
+    returns (precision, recall, f1), each a models x classes numpy.ndarray
+    '''
+    matrices = np.asarray(matrices)
+    hits = np.diagonal(matrices, axis1=-2, axis2=-1).astype(np.float64)
+    predicted = matrices.sum(axis=-2)
+    actual = matrices.sum(axis=-1) if support is None else np.broadcast_to(support, hits.shape)
+    precision = np.divide(hits, predicted, out=np.zeros_like(hits), where=predicted > 0)
+    recall = np.divide(hits, actual, out=np.zeros_like(hits), where=actual > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros_like(hits), where=(precision + recall) > 0)
+    return precision, recall, f1
+
+def MetricsTable(df_ident, classes, matrices, support = None):
+    '''
+    Compact metrics table of a data set, one row per model with its error % and the precision, recall and F1 of every class\n
+    matrices - dict of modelDesc -> confusion matrix (see ConfusionMatrices)\n
+    support - amount of rows of every class (see ClassSupport), needed when some predictions are not in the matrices
+    (None predictions are errors), taken from the matrices if None
+    '''
+    descs, stacked = list(matrices), np.array(list(matrices.values()))
+    precision, recall, f1 = ClassMetrics(stacked, support)
+    totals = stacked.sum(axis=(1, 2)) if support is None else np.full(len(descs), np.sum(support))
+    correct = np.trace(stacked, axis1=1, axis2=2)
+    table = pd.DataFrame({"Data set": df_ident, "Model": descs, "Total Entries": totals, "Correct": correct,
+                          "Error %": np.round((totals - correct) / np.maximum(totals, 1) * 100, 2)})
+    for idx, cls in enumerate(classes):
+        table[f"{cls} precision"] = np.round(precision[:, idx], 4)
+        table[f"{cls} recall"] = np.round(recall[:, idx], 4)
+        table[f"{cls} F1"] = np.round(f1[:, idx], 4)
+    return table
@@ -4,10 +4,17 @@
 # Roi Amzallag
 
 import math
+import os
+from os import path
+from importlib.util import find_spec
+import numpy as np
 import pandas as pd
+import joblib as jb
 from pandas.api.types import is_numeric_dtype
-from sklearn.preprocessing import OrdinalEncoder
 from Utilities.Discretizators import EntropyDisc
+from Models.Choices import DiscTypes
+# The pyarrow csv reader is optional, see ReadCSV
+HasPyArrow = find_spec("pyarrow") is not None
 
 __doc__ = '''Utility methods for dealing with Pandas ordered data (DataFrame, Series, Interval)'''
 
@@ -39,51 +46,225 @@ def Gain(data, attribute):
         result += (attr_vals[entry] / len(data)) * entropy
     return result
 
-# Heuristically determine which column is numeric or discrete
-# Less heuristic if a structure file is supplied
-def CleanDataFrame(df, bin_count, disc_type = "equal depth", struct_file = None):
-    # Make everything lower case
-    df = df.applymap(lambda x : x.lower() if type(x) == str else x)
+def DiscretizeColumn(column, class_codes, bin_count, disc_type):
+    '''
+    Bin a numeric column, returns a pandas.Series of intervals with the same index\n
+    column - pandas.Series without missing values\n
+    class_codes - integer coded class value of every row (numpy.ndarray), used by entropy discretization\n
+    Only takes numeric arrays, so joblib shares the ones larger than its max_nbytes (1 MB) with the worker processes
+    as read-only memory maps instead of pickling them
+    '''
+    if disc_type == "equal depth":
+        return pd.qcut(column, bin_count, duplicates="drop")
+    if disc_type == "equal width":
+        return pd.cut(column, bin_count, duplicates="drop")
+    # Entropy discretization
+    frame = pd.DataFrame({column.name: column, "class": class_codes})
+    return EntropyDisc(frame, column.name, max(int(math.log2(bin_count)),2))
 
-    if struct_file is not None:
-        value_matrix, col_list = StructureFileParser(struct_file)
-        #Remove any rows that dont have any classification or bogus ones
-        classes = value_matrix["class"]
-        del value_matrix["class"]
-        df = df[[item in classes for item in df["class"]]]
+class Preprocessor:
+    '''
+    Fitted preprocessing of a training data set, created and returned by CleanDataFrame\n
+    Holds everything that is needed to process new data the same way as the training data:
+    the column types, the fill values of missing cells (means and modes), the bin edges
+    of the discretized columns (as IntervalLookup objects) and the categories of every column
+    '''
+    def __init__(self, bin_count, disc_type = "equal depth", struct_file = None):
+        self.bin_count, self.disc_type, self.struct_file = bin_count, disc_type, struct_file
+        # columns - column order (including "class"), numeric - numeric columns of the raw data
+        self.columns, self.numeric, self.fill_values = [], [], dict()
+        # dtypes - pandas.CategoricalDtype of every categorical column, lookups - bin edges of the discretized columns
+        self.dtypes, self.lookups = dict(), dict()
+        # encoder - OrdinalEncoder with the categories of every column, for use with SKLearn classes
+        self.encoder = None
+        # lookup_codes - code in the column categories of every lookup position (sorted intervals) of the discretized columns
+        self.lookup_codes = dict()
+
+    # Heuristically determine which column is numeric or discrete
+    # Less heuristic if a structure file is supplied
+    # jobs - amount of processes to discretize the numeric columns with
+    def fit_transform(self, df, jobs = 1):
+        '''Fit the preprocessor on a training data set, returns the processed data set'''
+        # Make everything lower case
+        df = LowerStrings(df)
+
+        value_matrix = None
+        if self.struct_file is not None:
+            value_matrix, col_list = StructureFileParser(self.struct_file)
+            #Remove any rows that dont have any classification or bogus ones
+            classes = value_matrix["class"]
+            del value_matrix["class"]
+            df = df[[item in classes for item in df["class"]]]
+            for col in df:
+                if col not in col_list:
+                    df = df.drop(labels=col, axis=1)
+        df = df.copy()
+        self.columns = list(df.columns)
+
+        numeric_cols = []
         for col in df:
-            if col not in col_list:
-                df = df.drop(labels=col, axis=1)
+            if is_numeric_dtype(df[col]):
+                self.numeric.append(col)
+                # Replace NaNs with mean value
+                self.fill_values[col] = df[col].mean()
+                df[col] = df[col].fillna(self.fill_values[col])
+                if self.bin_count >= 1 and self.disc_type in DiscTypes:
+                    numeric_cols.append(col)
+            else:
+                # Fill empty cells with the most common value
+                self.fill_values[col] = df[col].value_counts().idxmax()
+                df[col] = df[col].fillna(self.fill_values[col])
+                if col == "class":
+                    continue
+                # Nominal columns are stored as categorical codes, in the order of the structure file if supplied
+                if value_matrix is not None and value_matrix[col] is not None:
+                    df[col] = pd.Categorical(df[col], categories=value_matrix[col])
+                elif not isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = pd.Categorical(df[col], categories=sorted(df[col].unique()))
+                self.dtypes[col] = df[col].dtype
+
+        # Bin the values, every column is independent so they can be discretized in parallel
+        class_codes = pd.factorize(df["class"])[0]
+        all_bins = jb.Parallel(n_jobs=jobs, mmap_mode="r")(jb.delayed(DiscretizeColumn)(df[col], class_codes, self.bin_count, self.disc_type)
+                                                           for col in numeric_cols)
+        for col, bins in zip(numeric_cols, all_bins):
+            # Store the column as categorical codes (int8/int16) with the intervals as its categories,
+            # only intervals that are in use are kept (same as the values of an interval object column)
+            df[col] = bins.cat.remove_unused_categories()
+            self.dtypes[col] = df[col].dtype
+            self.lookups[col] = IntervalLookup(self.dtypes[col].categories)
+            self.lookup_codes[col] = self.dtypes[col].categories.get_indexer(self.lookups[col].intervals)
+
+        x = SplitXY(df)[0]
+        if all(col in self.dtypes for col in x):
+            # Imported here so SKLearn is only loaded when a preprocessor is fitted
+            from sklearn.preprocessing import OrdinalEncoder
+            self.encoder = OrdinalEncoder(categories=[list(self.dtypes[col].categories) for col in x]).fit(x)
+        return df
+
+    def transform(self, df, strict = False):
+        '''
+        Process a new data set with the fitted values (vectorized), the result has the same columns
+        and categorical dtypes as the processed training data, the "class" column is optional\n
+        Values that are not in the vocabulary of a column get the code -1 (missing)\n
+        strict - numeric values outside of every interval of their column are left missing as well,
+        instead of going to the nearest interval (see IntervalLookup.codes)
+        '''
+        df = LowerStrings(df)
+        # The columns are collected and the data frame is built once, setting columns one by one is slow for small batches
+        columns = dict()
+        for col in [col for col in self.columns if col in df]:
+            values = df[col]
+            if col in self.fill_values:
+                values = values.fillna(self.fill_values[col])
+            if col in self.lookups:
+                # Translate lookup positions (sorted intervals) into the codes of the column categories
+                positions = self.lookups[col].positions(values, strict)
+                codes = np.where(positions >= 0, self.lookup_codes[col][positions], -1)
+                values = pd.Categorical.from_codes(codes, dtype=self.dtypes[col])
+            elif col in self.dtypes:
+                values = pd.Categorical(values, dtype=self.dtypes[col])
+            columns[col] = values
+        return pd.DataFrame(columns, index=df.index)
 
+# Cleans and processes the training data, see Preprocessor.fit_transform
+# returns the processed data set and the fitted Preprocessor
+def CleanDataFrame(df, bin_count, disc_type = "equal depth", struct_file = None, jobs = 1):
+    preprocessor = Preprocessor(bin_count, disc_type, struct_file)
+    return preprocessor.fit_transform(df, jobs), preprocessor
+
+def LowerStrings(df):
+    '''Lower case every string cell, categorical and numeric columns are already clean so they are kept as they are'''
+    return pd.DataFrame({col: values if isinstance(values.dtype, pd.CategoricalDtype) or is_numeric_dtype(values)
+                              else values.map(lambda x: x.lower() if type(x) == str else x)
+                         for col, values in df.items()}, index=df.index)
+
+def StructureDtypes(struct_file):
+    '''pandas.read_csv dtype of every column of the structure file, numeric columns are read as float32
+       and nominal ones as categorical columns (see ReadCSV)'''
+    value_matrix, cols = StructureFileParser(struct_file)
+    return {col: np.float32 if value_matrix[col] is None else "category" for col in cols}
+
+def TypeColumns(df, value_matrix):
+    '''
+    Finish the column types of a data set read with StructureDtypes (in place)\n
+    Nominal columns get the declared values of the structure file as their categories, only the labels are lower cased.
+    Values that are not declared are added after them as extra categories, so they stay unknown values
+    (Preprocessor.transform gives them the code -1 like any value outside of the training categories) instead of
+    becoming missing values that are filled, the "class" column is kept as plain values.
+    Numeric columns with whole values only (and no missing values) are stored as int32
+    '''
     for col in df:
-        if is_numeric_dtype(df[col]):
-            # Replace NaNs with mean value
-            df[col].fillna(df[col].mean(), inplace = True)
-            if bin_count < 1:
-                continue
-            # Bin the values
-            if disc_type == "equal depth":
-                bins = pd.qcut(df[col], bin_count, duplicates="drop")
-            elif disc_type == "equal width":
-                bins = pd.cut(df[col], bin_count, duplicates="drop")
-            elif disc_type == "entropy":
-                bins = EntropyDisc(df, col, max(int(math.log2(bin_count)),2))
-            else:
-                if struct_file is not None and value_matrix[col] is None:
-                    value_matrix[col] = sorted(df[col].unique())
-                continue # Dont do discretization on this
-            # Replace each cell with its bin object
-            for i in range(len(df[col])):
-                df.at[i, col] = bins[i]
-            if struct_file is not None and value_matrix[col] is None:
-                value_matrix[col] = sorted(set(bins))
-        else:
-            # Fill empty cells with the most common value
-            df[col].fillna(df[col].value_counts().idxmax(), inplace = True)
-    if struct_file is None:
-        return df, None
-    else: # Create a an ordinal encoder object for use with SKLearn classes
-        return df, OrdinalEncoder(categories=list(value_matrix.values())).fit(SplitXY(df)[0])
+        if col not in value_matrix:
+            continue
+        if value_matrix[col] is None:
+            if df[col].notna().all() and (df[col] % 1 == 0).all():
+                df[col] = df[col].astype(np.int32)
+        elif isinstance(df[col].dtype, pd.CategoricalDtype):
+            labels = df[col].cat.categories.str.lower()
+            categories = pd.Index(value_matrix[col]).append(pd.Index(labels.unique()).difference(value_matrix[col], sort=False))
+            # Lower case label -> position in the categories, the extra -1 keeps missing values (code -1) missing
+            remap = np.append(categories.get_indexer(labels), -1)
+            df[col] = pd.Categorical.from_codes(remap[df[col].cat.codes], dtype=pd.CategoricalDtype(categories))
+            if col == "class":
+                df[col] = df[col].astype(object)
+    return df
+
+def ReadCSV(file_path, struct_file = None, chunksize = None):
+    '''
+    Read a csv data set, with the column types of the structure file if supplied (see StructureDtypes and TypeColumns)
+    instead of inferring them and lower casing every cell\n
+    Uses the pyarrow csv reader if it is installed (not for chunked reads)\n
+    chunksize - returns an iterator of data frames of chunksize rows if given
+    '''
+    value_matrix, dtypes = None, None
+    if struct_file is not None:
+        value_matrix, dtypes = StructureFileParser(struct_file)[0], StructureDtypes(struct_file)
+    if chunksize is not None:
+        chunks = pd.read_csv(file_path, dtype=dtypes, chunksize=chunksize)
+        return chunks if value_matrix is None else (TypeColumns(chunk, value_matrix) for chunk in chunks)
+    df = pd.read_csv(file_path, dtype=dtypes, engine="pyarrow" if HasPyArrow else None)
+    return df if value_matrix is None else TypeColumns(df, value_matrix)
+
+def ReplaceFile(file_path, write):
+    '''
+    Write a file with write(file object) to a temporary file next to it and rename it over file_path, so a process that
+    reads (or memory maps) the old file keeps the old contents instead of a partly written file
+    '''
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        write(file)
+    os.replace(temp_path, file_path)
+
+def SaveCodes(df, dir_path):
+    '''
+    Save a data set in a columnar binary form that can be reloaded as is with LoadCodes\n
+    Every column is stored as its categorical codes in "<column number>.npy" (in the dtype pandas uses for them, int8 for up to 127 categories),
+    the categories of every column (the bin edges of the discretized columns) in "dtypes.joblib" and the row index in "index.npy",
+    non categorical columns (e.g. "class") are stored as the codes of their distinct values.
+    Existing files are replaced (see ReplaceFile), data sets that are loaded from them are not changed
+    '''
+    os.makedirs(dir_path, exist_ok=True)
+    # column -> (categorical dtype of the codes, dtype of the column)
+    dtypes = dict()
+    for idx, col in enumerate(df):
+        column = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype("category")
+        dtypes[col] = (column.dtype, df[col].dtype)
+        ReplaceFile(path.join(dir_path, f"{idx}.npy"), lambda file: np.save(file, column.cat.codes.values))
+    ReplaceFile(path.join(dir_path, "index.npy"), lambda file: np.save(file, df.index.values))
+    ReplaceFile(path.join(dir_path, "dtypes.joblib"), lambda file: jb.dump(dtypes, file))
+
+def LoadCodes(dir_path, mmap_mode = "r"):
+    '''
+    Load a data set saved with SaveCodes, the codes are memory mapped (read only by default) and used by the categorical
+    columns without copying them, so loading does not depend on the data size and worker processes share the same pages
+    '''
+    columns = dict()
+    for idx, (col, (dtype, col_dtype)) in enumerate(jb.load(path.join(dir_path, "dtypes.joblib")).items()):
+        columns[col] = pd.Categorical.from_codes(np.load(path.join(dir_path, f"{idx}.npy"), mmap_mode=mmap_mode), dtype=dtype)
+        if not isinstance(col_dtype, pd.CategoricalDtype):
+            columns[col] = np.asarray(columns[col], dtype=col_dtype)
+    return pd.DataFrame(columns, index=np.load(path.join(dir_path, "index.npy")), copy=False)
 
 def StructureFileParser(struct_file):
     mtx = dict()
@@ -118,6 +299,129 @@ def FindBestInterval(value, intervals):
     
     return min_interval if min_interval.right >= value else max_interval
 
+class IntervalLookup:
+    '''
+    Sorted interval edges of a single column, used to fit raw values into their interval\n
+    Gives the same results as FindBestInterval but for a whole column at once in O(n log k),
+    it is built once per column and shared between all the models
+    '''
+    def __init__(self, intervals):
+        self.intervals = pd.IntervalIndex(sorted(intervals))
+        self.left, self.right = self.intervals.left.values, self.intervals.right.values
+        self.closed = self.intervals.closed
+        self.exact = {interval: pos for pos, interval in enumerate(self.intervals)}
+
+    def codes(self, values, strict = False):
+        '''Returns the position (in self.intervals) of the most fitting interval for every numeric value,
+           values outside of every interval (and missing values) get -1 instead if strict'''
+        values = np.asarray(values, dtype=float)
+        if self.closed in ("right", "both"):
+            pos = np.searchsorted(self.right, values, side="left")
+        else:
+            pos = np.searchsorted(self.left, values, side="right") - 1
+        pos = np.clip(pos, 0, len(self.intervals) - 1)
+        left, right = self.left[pos], self.right[pos]
+        inside = (left < values) if self.closed in ("right", "neither") else (left <= values)
+        inside &= (values <= right) if self.closed in ("right", "both") else (values < right)
+        if strict:
+            return np.where(inside, pos, -1)
+        # Values outside of every interval go to the first one if they are below it, otherwise to the last one
+        outside = np.where(values <= self.right[0], 0, len(self.intervals) - 1)
+        return np.where(inside, pos, outside)
+
+    def position(self, value, strict = False):
+        '''Position of the most fitting interval for a single value, intervals are matched exactly (-1 if unknown)'''
+        if IsInterval(value):
+            return self.exact.get(value, -1)
+        return int(self.codes([value], strict)[0])
+
+    def positions(self, series, strict = False):
+        '''Positions of the most fitting intervals for a pandas.Series of numeric values or intervals (see codes for strict)'''
+        if is_numeric_dtype(series.dtype):
+            return self.codes(series.values, strict)
+        codes, uniques = pd.factorize(series)
+        # Missing values have the code -1, which picks the last entry (the last interval) like FindBestInterval
+        missing = -1 if strict else len(self.intervals) - 1
+        found = np.array([self.position(value, strict) for value in uniques] + [missing], dtype=np.int64)
+        return found[codes]
+
+    def find(self, value):
+        '''Find the most fitting interval for a value, see FindBestInterval'''
+        if IsInterval(value):
+            return value
+        return self.intervals[self.position(value)]
+
+def BuildIntervalLookups(x, categories = None):
+    '''Build an IntervalLookup for every interval column of x\n
+       x - pandas.DataFrame without the "class" column\n
+       categories - list of category lists, one per column (e.g. OrdinalEncoder.categories_), taken from x if None\n
+       returns dict of column name -> IntervalLookup'''
+    lookups = dict()
+    for idx, col in enumerate(x):
+        cats = categories[idx] if categories is not None else x[col].unique()
+        if len(cats) > 0 and IsInterval(cats[0]):
+            lookups[col] = IntervalLookup(cats)
+    return lookups
+
+def EncodeColumn(column, cats, lookup = None, remaps = None, strict = False):
+    '''Encode a pandas.Series into the position of its values in cats (-1 for unknown values),
+       numeric values are fitted into their interval first when cats are intervals\n
+       remaps - dict that keeps the category remap of categorical columns between calls (see EncodeDataFrame)\n
+       strict - numeric values outside of every interval are unknown instead of going to the nearest one'''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Work directly on the codes, only the categories themselves need to be encoded.
+        # The data sets processed by the same Preprocessor share the categories of every column,
+        # so the remap is kept while the column has the same categories object
+        categories = column.cat.categories
+        entry = remaps.get(column.name) if remaps is not None else None
+        if entry is None or entry[0] is not categories:
+            entry = (categories, np.append(EncodeColumn(pd.Series(categories), cats, lookup, strict=strict), -1))
+            if remaps is not None:
+                remaps[column.name] = entry
+        return entry[1][column.cat.codes.values]
+    mapping = {cat: code for code, cat in enumerate(cats)}
+    if IsInterval(cats[0]):
+        lookup = IntervalLookup(cats) if lookup is None else lookup
+        # Translate lookup positions into category codes, the extra entry handles unknown intervals (-1)
+        remap = np.array([mapping.get(interval, -1) for interval in lookup.intervals] + [-1], dtype=np.int64)
+        return remap[lookup.positions(column, strict)]
+    return column.map(mapping).fillna(-1).astype(np.int64).values
+
+def EncodeValue(value, codes, lookup = None, strict = False):
+    '''Encode a single value into its position in the categories (-1 if unknown), the same code as EncodeColumn\n
+       codes - dict of category -> position\n
+       lookup - IntervalLookup of the categories if they are intervals, numeric values are fitted into their interval first'''
+    if lookup is not None and not IsInterval(value):
+        pos = lookup.position(value, strict)
+        return -1 if pos < 0 else codes.get(lookup.intervals[pos], -1)
+    return codes.get(value, -1)
+
+def EncodeDataFrame(x, categories, lookups = None, remaps = None, strict = False):
+    '''Encode every column of x into the position of its values in the matching categories list,\n
+       numeric values are fitted into their interval first when the categories are intervals.\n
+       x - pandas.DataFrame without the "class" column\n
+       categories - list of category lists, one per column (e.g. OrdinalEncoder.categories_)\n
+       lookups - dict of shared IntervalLookup objects (see BuildIntervalLookups), created if missing\n
+       remaps - dict of column name -> category remap of its categorical column, kept by the caller (e.g. a model)
+       for the data sets it encodes with the same cats and lookups, so the categories are only encoded once\n
+       strict - numeric values outside of every interval (and missing values) are encoded as -1 instead of the nearest interval\n
+       returns numpy.ndarray of codes, unknown values are encoded as -1'''
+    codes = np.empty(x.shape, dtype=np.int64)
+    for idx, (col, cats) in enumerate(zip(x, categories)):
+        codes[:, idx] = EncodeColumn(x[col], cats, lookups.get(col) if lookups is not None else None, remaps, strict)
+    return codes
+
+def DistinctRows(x):
+    '''Group the rows of x by their values (missing values are grouped together),\n
+       x - pandas.DataFrame without the "class" column\n
+       returns (positions of one row per distinct group, group number of every row),
+       so x.iloc[positions] has the distinct rows and results on them are broadcast back with results[groups]'''
+    codes = np.empty(x.shape, dtype=np.int64)
+    for idx, col in enumerate(x):
+        codes[:, idx] = pd.factorize(x[col])[0]
+    _, positions, groups = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    return positions, groups.reshape(-1)
+
 def IsInterval(value):
     '''Returns True if value is an interval, False otherwise'''
     return isinstance(value, (pd.Interval, pd.IntervalIndex))
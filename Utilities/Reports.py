@@ -0,0 +1,58 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Confusion matrix pdf reports, kept apart from ModelBuilder so matplotlib is only imported when a report is drawn,
+# the pdfs can also be drawn later from the confusion matrices a run saved (ModelBuilder.SaveMatrices)
+# USAGE: python Utilities/Reports.py <output folder>
+import sys
+from os import path
+import numpy as np
+import joblib as jb
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from sklearn.metrics import ConfusionMatrixDisplay
+
+# Name of the confusion matrices file in the output folder
+MatricesFile = "Confusion matrices.joblib"
+
+def PlotConfusionMatrices(file_path, classes, matrices, cols, page_size):
+    '''
+    Save a pdf with a confusion matrix plot for every modelDesc -> matrix in matrices\n
+    cols - plots per row, page_size - plots per page (parameter sweeps get more pages instead of a huge figure)
+    '''
+    # Inspired by https://stackoverflow.com/questions/59165149/plot-confusion-matrix-with-scikit-learn-without-a-classifier
+    # And https://scikit-learn.org/0.18/auto_examples/model_selection/plot_confusion_matrix.html
+    items = list(matrices.items())
+    with PdfPages(file_path) as pdf:
+        for page in range(0, len(items), page_size):
+            page_items = items[page:page + page_size]
+            rows = int(np.ceil(len(page_items) / cols))
+            fig, axes = plt.subplots(rows, cols, squeeze=False)
+            axes_list = []
+            for ax_row in axes:
+                axes_list += [*ax_row]
+            for (modelDesc, mtx), ax in zip(page_items, axes_list):
+                ConfusionMatrixDisplay(mtx, display_labels=classes).plot(ax=ax, cmap=plt.cm.Blues)
+                ax.set_title(modelDesc)
+                ax.set_ylabel("Expected class")
+                ax.set_xlabel("Predicted class")
+            fig.subplots_adjust(hspace=0.3, wspace=0.3)
+            fig.set_size_inches(cols * 5.2, rows * 4.1)
+            pdf.savefig(fig)
+            plt.close(fig) # Figures are kept alive by pyplot until closed
+
+def RenderReports(output_dir, log = print):
+    '''Draw the confusion matrix pdfs of every data set from the confusion matrices saved in output_dir'''
+    saved = jb.load(path.join(output_dir, MatricesFile))
+    for df_ident, classes, matrices, _ in saved["evaluations"]:
+        file_path = path.join(output_dir, f"Confusion Matrix - {df_ident}.pdf")
+        PlotConfusionMatrices(file_path, classes, matrices, saved["cols"], saved["page_size"])
+        log(f"Saved {file_path}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or not path.isfile(path.join(sys.argv[1], MatricesFile)):
+        print(f"USAGE: python {sys.argv[0]} <output folder with {MatricesFile}>")
+        sys.exit(0)
+    RenderReports(sys.argv[1])
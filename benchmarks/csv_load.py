@@ -0,0 +1,46 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Benchmark of the csv loading, compares pandas.read_csv with inferred types followed by lower casing every cell
+# (what CleanDataFrame got before) with PDUtils.ReadCSV and the column types of the structure file,
+# reports the load time and memory of both and makes sure both give the same values
+# USAGE: python benchmarks/csv_load.py [csv file path] [structure file path] [repeats]
+import sys
+from os import path
+from time import perf_counter
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+from Utilities.PDUtils import ReadCSV, HasPyArrow
+
+# The old loading, kept here for comparison only
+def OldReadCSV(file_path):
+    df = pd.read_csv(file_path)
+    return df.apply(lambda col: col if isinstance(col.dtype, pd.CategoricalDtype)
+                                else col.map(lambda x: x.lower() if type(x) == str else x))
+
+def Measure(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        df = func()
+        times.append(perf_counter() - start)
+    return df, min(times), df.memory_usage(deep=True).sum() / 2**20
+
+if __name__ == "__main__":
+    root = path.dirname(path.dirname(path.abspath(__file__)))
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else path.join(root, "train.csv")
+    struct_file = sys.argv[2] if len(sys.argv) > 2 else path.join(root, "Structure.txt")
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    old, old_time, old_memory = Measure(lambda: OldReadCSV(csv_file), repeats)
+    new, new_time, new_memory = Measure(lambda: ReadCSV(csv_file, struct_file), repeats)
+    print(f"pyarrow reader: {HasPyArrow}")
+    print(f"{'':<8} {'time (s)':>9} {'memory (MB)':>12}")
+    print(f"{'old':<8} {old_time:>9.3f} {old_memory:>12.1f}")
+    print(f"{'new':<8} {new_time:>9.3f} {new_memory:>12.1f}")
+    same = all(old[col].astype(float).equals(new[col].astype(float)) if is_numeric_dtype(new[col])
+               else old[col].astype(str).equals(new[col].astype(str)) for col in new)
+    print(f"same values: {same}")
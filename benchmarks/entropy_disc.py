@@ -0,0 +1,53 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Benchmark of the entropy discretization, compares the old DataFrame filtering version with the
+# sorted prefix sum version in Utilities.Discretizators and makes sure both produce the same bins
+# USAGE: python benchmarks/entropy_disc.py [training file path] [bin count]
+import sys
+import math
+from os import path
+from time import perf_counter
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+from Utilities.Discretizators import CutpointEntropy, EntropyDisc
+
+# The old implementation, kept here for comparison only
+def OldEntropyDisc(df, attr, levels, init=True):
+    if len(df) <= 1 or levels == 0:
+        return [] if init is False else df[attr]
+    df_orig, df = df, df.sort_values(by=[attr]) if init is True else df
+    unique_values = df[attr].unique()
+    if len(unique_values) <= 1:
+        return [] if init is False else df[attr]
+    entropies = pd.Series({value: CutpointEntropy(df, attr, value) for value in unique_values})
+    cutpoint = entropies.idxmin()
+    S1, S2 = df[df[attr] <= cutpoint], df[df[attr] > cutpoint]
+    cutpoints = OldEntropyDisc(S1, attr, levels - 1, False) + [cutpoint] + OldEntropyDisc(S2, attr, levels - 1, False)
+    if init is not True:
+        return cutpoints
+    cutpoints += [unique_values.min(), unique_values.max()]
+    return pd.cut(df_orig[attr], sorted(cutpoints), duplicates="drop", include_lowest=True)
+
+if __name__ == "__main__":
+    train_file = sys.argv[1] if len(sys.argv) > 1 else path.join(path.dirname(path.dirname(path.abspath(__file__))), "train.csv")
+    bin_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    levels = max(int(math.log2(bin_count)), 2) # Same as CleanDataFrame
+    df = pd.read_csv(train_file)
+    df["class"] = df["class"].str.lower()
+    print(f"{'column':<10} {'uniques':>8} {'old (s)':>10} {'new (s)':>10} {'speedup':>8} same bins")
+    for col in df:
+        if not is_numeric_dtype(df[col]):
+            continue
+        df[col] = df[col].fillna(df[col].mean())
+        start = perf_counter()
+        old = OldEntropyDisc(df, col, levels)
+        old_time = perf_counter() - start
+        start = perf_counter()
+        new = EntropyDisc(df, col, levels)
+        new_time = perf_counter() - start
+        print(f"{col:<10} {df[col].nunique():>8} {old_time:>10.3f} {new_time:>10.4f} {old_time / new_time:>7.0f}x {old.equals(new)}")
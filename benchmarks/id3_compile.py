@@ -0,0 +1,62 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Benchmark of the compiled Type1ID3Tree, compares the old recursive batch prediction with the
+# flat array traversal of CompiledID3Tree, makes sure both give the same results and compares the joblib file sizes
+# USAGE: python benchmarks/id3_compile.py [training file path] [min gain]
+import sys
+import os
+import tempfile
+from os import path
+from time import perf_counter
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import joblib as jb
+import Utilities.PDUtils as utils
+from Utilities.PDUtils import CleanDataFrame
+from Models.Type1ID3Tree import Type1ID3Tree
+
+# The old implementation, kept here for comparison only
+def OldFillPredictions(tree, codes, columns, rows, results):
+    results[rows] = tree.classResult
+    if tree.subTrees is None or len(rows) == 0:
+        return
+    values = codes[rows, columns[tree.rootAttr]]
+    categories = list(tree.attr_dict[tree.rootAttr])
+    for entry, subTree in tree.subTrees.items():
+        OldFillPredictions(subTree, codes, columns, rows[values == categories.index(entry)], results)
+
+def OldPredictBatch(tree, df):
+    x = df.drop(labels=["class"], axis=1, errors="ignore")
+    codes = utils.EncodeDataFrame(x, [tree.attr_dict[attr] for attr in x], tree.lookups)
+    results = np.empty(len(x), dtype=object)
+    OldFillPredictions(tree, codes, {attr: idx for idx, attr in enumerate(x)}, np.arange(len(x)), results)
+    return results
+
+def FileSize(obj):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = path.join(temp_dir, "model.joblib")
+        jb.dump(obj, file_path)
+        return os.path.getsize(file_path)
+
+if __name__ == "__main__":
+    train_file = sys.argv[1] if len(sys.argv) > 1 else path.join(path.dirname(path.dirname(path.abspath(__file__))), "train.csv")
+    min_gain = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    train_df, _ = CleanDataFrame(pd.read_csv(train_file), -1, "none")
+    print(f"{'disc':<12} {'nodes':>6} {'old (s)':>8} {'new (s)':>8} {'speedup':>8} {'old (KB)':>9} {'new (KB)':>9} same results")
+    for disc in ("equal width", "equal depth", "entropy"):
+        df, preprocessor = CleanDataFrame(train_df, 5, disc)
+        tree = Type1ID3Tree(df, encoder=preprocessor.encoder, lookups=preprocessor.lookups, min_gain=min_gain)
+        compiled = tree.compile()
+        start = perf_counter()
+        old = OldPredictBatch(tree, df)
+        old_time = perf_counter() - start
+        start = perf_counter()
+        new = compiled.predict_batch(df)
+        new_time = perf_counter() - start
+        print(f"{disc:<12} {len(compiled.features):>6} {old_time:>8.3f} {new_time:>8.4f} {old_time / new_time:>7.1f}x "
+              f"{FileSize(tree) / 1024:>9.0f} {FileSize(compiled) / 1024:>9.0f} {(old == new).all()}")
@@ -0,0 +1,48 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Benchmark of the cold start latency of the CLI, runs a few commands under "python -X importtime" and reports
+# their wall time, the total import time and the slowest top level imports
+# USAGE: python benchmarks/import_time.py [repeats] [amount of top imports to show]
+import sys
+import subprocess
+from os import path
+from time import perf_counter
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+COMMANDS = {
+    "cli.py -help": [path.join(ROOT, "cli.py"), "-help"],
+    "cli.py argument error": [path.join(ROOT, "cli.py"), "-bins", "0"],
+    "cli.py -knn-index error": [path.join(ROOT, "cli.py"), "-knn-index", "bogus"],
+    "cli.py -models error": [path.join(ROOT, "cli.py"), "-models", "bogus"],
+    "import ModelBuilder": ["-c", "import Models.ModelBuilder"],
+    "import all models": ["-c", "from Models.ModelBuilder import ModelBuilder\n"
+                                "for entry in ModelBuilder.ModelTypes: ModelBuilder.ModelClass(entry)"],
+}
+
+def ImportTimes(args):
+    '''Run python -X importtime with args, returns (wall time, {top level module: cumulative import time in seconds})'''
+    start = perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=ROOT, capture_output=True, text=True)
+    wall = perf_counter() - start
+    times = dict()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package, nested imports are indented
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            times[name.strip()] = int(cumulative) / 1e6
+    return wall, times
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"{'command':<24} {'wall (s)':>9} {'imports (s)':>12}  slowest top level imports")
+    for desc, args in COMMANDS.items():
+        # The fastest run, so the disk cache of the first run does not count
+        wall, times = min((ImportTimes(args) for _ in range(repeats)), key=lambda run: run[0])
+        slowest = sorted(times.items(), key=lambda item: -item[1])[:top]
+        print(f"{desc:<24} {wall:>9.3f} {sum(times.values()):>12.3f}  " + ", ".join(f"{name} {secs:.3f}" for name, secs in slowest))
@@ -0,0 +1,89 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Benchmark of the scoring server (server.py), compares scoring single rows with Preprocessor.transform and Model.evaluate
+# (one row at a time, the way a loaded ModelBuilder object was used before) with single row JSON requests
+# sent by concurrent clients to the server, which scores the requests that arrive together in batches
+# USAGE: python benchmarks/scoring_server.py <output folder of a "-joblib enable" run> [csv file path] [requests] [clients]
+import sys
+import json
+import asyncio
+from os import path
+from time import perf_counter
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import joblib as jb
+from server import Serve
+
+def Percentiles(seconds):
+    return ", ".join(f"p{pct} {value * 1000:.2f}ms" for pct, value in zip((50, 90, 99), np.percentile(seconds, (50, 90, 99))))
+
+def EvaluateRows(builder, df):
+    '''Seconds per row of every model of builder with Model.evaluate on one preprocessed row at a time'''
+    times = []
+    for _, row in df.iterrows():
+        start = perf_counter()
+        for modelObj in builder.models:
+            modelObj.evaluate(builder.preprocessors[modelObj.disc].transform(row.to_frame().T).iloc[0])
+        times.append(perf_counter() - start)
+    return times
+
+async def Client(port, bodies, times):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for body in bodies:
+        start = perf_counter()
+        writer.write(f"POST /predict HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        times.append(perf_counter() - start)
+    writer.close()
+
+async def ServerRun(builder_path, bodies, clients):
+    '''Seconds per request, total seconds (without loading the models) and the server statistics of clients sending bodies concurrently'''
+    started = asyncio.get_running_loop().create_future()
+    serving = asyncio.create_task(Serve(builder_path, port=0, started=started))
+    port = (await started).sockets[0].getsockname()[1]
+    times, start = [], perf_counter()
+    await asyncio.gather(*[Client(port, bodies[idx::clients], times) for idx in range(clients)])
+    wall = perf_counter() - start
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n")
+    stats = json.loads((await reader.read()).split(b"\r\n\r\n", 1)[1])
+    serving.cancel()
+    return times, wall, stats
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or not path.isfile(path.join(sys.argv[1], "ModelBuilder.joblib")):
+        print(f"USAGE: python {sys.argv[0]} <output folder with ModelBuilder.joblib> [csv file path] [requests] [clients]")
+        sys.exit(0)
+    root = path.dirname(path.dirname(path.abspath(__file__)))
+    builder_path = path.join(sys.argv[1], "ModelBuilder.joblib")
+    csv_file = sys.argv[2] if len(sys.argv) > 2 else path.join(root, "test.csv")
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    clients = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+    df = pd.read_csv(csv_file)
+    builder = jb.load(builder_path)
+    print(f"{len(builder.models)} models")
+
+    times = EvaluateRows(builder, df.head(50))
+    print(f"evaluate, one row at a time:  {1 / np.mean(times):8.1f} rows/s, {Percentiles(times)}")
+
+    # The clients do not send the class column
+    rows = json.loads(df.drop(columns=["class"], errors="ignore").to_json(orient="records"))
+    bodies = [json.dumps(rows[idx % len(rows)]).encode() for idx in range(requests)]
+    times, wall, stats = asyncio.run(ServerRun(builder_path, bodies, clients))
+    print(f"server, {clients} clients:       {requests / wall:8.1f} rows/s, {Percentiles(times)}")
+    print(f"rows per batch: {stats['batch rows']}")
+    slowest = sorted(stats["models (ms)"].items(), key=lambda item: -item[1].get("p50", 0))[:3]
+    print("slowest models per batch: " + ", ".join(f"{desc} p50 {info['p50']}ms" for desc, info in slowest))
@@ -6,9 +6,11 @@
 import sys
 import os
 from os import path
-from Models.ModelBuilder import ModelBuilder
 from datetime import datetime
-import joblib as jb
+# ModelBuilder, the models and the libraries they use are imported once the arguments are parsed,
+# so -help and argument errors do not wait for them (see benchmarks/import_time.py),
+# the option values are checked against the dependency free Models.Choices
+from Models.Choices import KNNIndexes, DiscTypes, EvalSets, SelectNames, SelectModels
 
 # https://stackoverflow.com/a/287944/2457002
 class bcolors:
@@ -26,6 +28,7 @@ USAGE: python cli.py -train <training file path> [Optional arguments]
 NOTE: Paths with spaces are must be quoted by double quotes e.g. "Path with spaces\\test.csv"
 Required:
 \t-train  <path to file> \t Path to training file (*.csv)
+\t  or -update <path to file> Labelled rows (*.csv) to fold into the Naive Bayes and KMEANS models of ModelBuilder.joblib in the output folder
 Optional without specific order:
 \t-struct <path to file> \t Path to structure file (*.txt)
 \t-test   <path to file> \t Path to test file (*.csv)
@@ -36,6 +39,17 @@ Optional without specific order:
 \t-leafs  [1..] \t\t Minimum amount of data samples for splitting (Decision Trees) (default is 0)
 \t-neighbors [1...]\t Number of nearest neighbors (K-nearest neigbors) (Odd number, default is 5)
 \t-clusters [1...]\t Number of clusters (Cluster algorithms) (default is 8)
+\t  (-bins, -gain, -leafs, -neighbors and -clusters also take a list 0.1,0.2 or a range 3:11:2 to sweep over)
+\t-jobs   [1..] \t\t Number of processes to build and evaluate the models with (default is 1)
+\t-chunksize [1..] \t Evaluate the test file in chunks of this many rows, for files larger than memory
+\t-cachesize [1..] \t Size limit of the joblib model cache in MB (default is 1024)
+\t-knn-index [auto, brute, kdtree, balltree, table, hnsw] Neighbor search backend of the KNN models (default is "auto")
+\t-searchjobs [1..] \t Number of threads for the KNN neighbor search (default is 1)
+\t-kmeansbatch [1..] \t Fit the KMEANS models with mini batches of this many rows (default is full batch)
+\t-report [none, metrics, full] Output reports, metrics writes only metrics.csv and the overview (default is "full")
+\t-models [type1bayes, type2bayes, type1id3tree, type2tree, knn, kmeans] Comma separated model types to build (default is all)
+\t-disc [equal-width, equal-depth, entropy] Comma separated discretization types to build the models with (default is all)
+\t-eval [processed, unprocessed, test] Comma separated data sets to evaluate the models on (default is all)
 Miscellaneous:
 \t-help \t\t\t Shows this menu'''
 err_help = "Type \"python cli.py -help\" to see help information"
@@ -63,6 +77,17 @@ class ConsoleOutput:
             "-joblib": "disable",
             "-neighbors": 5,
             "-clusters": 8,
+            "-jobs": 1,
+            "-chunksize": None,
+            "-cachesize": 1024,
+            "-knn-index": "auto",
+            "-searchjobs": 1,
+            "-kmeansbatch": None,
+            "-report": "full",
+            "-models": None,
+            "-disc": None,
+            "-eval": None,
+            "-update": None,
         }
 
         self.args, processed = argv[1:], 0
@@ -73,25 +98,36 @@ class ConsoleOutput:
             # Pull 2 at a time to process
             arg, val = self.args[processed], self.args[processed + 1]
             try:
-                if arg in ["-bins", "-leafs", "-neighbors", "-clusters"]: # Integer values
-                    try:
-                        val = int(val)
-                    except:  # Replace python-speak with custom message
-                        raise ValueError(f"Invalid {arg} value")
-                    if val <= 0:
-                        raise ValueError(f"{arg} value must be 1 or higher")
-                    if arg == "-neighbors" and val % 2 == 0:
-                        raise ValueError(f"{arg} value must be odd")
+                if arg in ["-bins", "-leafs", "-neighbors", "-clusters", "-jobs", "-chunksize", "-cachesize", "-searchjobs", "-kmeansbatch"]: # Integer values
+                    # Model parameters can be swept over a list or range of values
+                    values = self.parseValues(arg, val, int)
+                    for value in values:
+                        if value <= 0:
+                            raise ValueError(f"{arg} value must be 1 or higher")
+                        if arg == "-neighbors" and value % 2 == 0:
+                            raise ValueError(f"{arg} value must be odd")
+                    val = values[0] if len(values) == 1 else values
                 elif arg in ["-gain"]: # Floating point values
-                    try:
-                        val = float(val)
-                    except: # Replace python-speak with custom message
-                        raise ValueError(f"Invalid {arg} value")
-                    if val < 0.0 or val == float("inf"):
-                        raise ValueError(f"{arg} value must be 0.0 or higher")
+                    values = self.parseValues(arg, val, float)
+                    for value in values:
+                        if value < 0.0 or value == float("inf"):
+                            raise ValueError(f"{arg} value must be 0.0 or higher")
+                    val = values[0] if len(values) == 1 else values
                 elif arg == "-joblib":
                     if val not in ["enable", "purge", "disable"]:
                         raise ValueError(f"{val} is an invalid {arg} value")
+                elif arg == "-report":
+                    if val not in ["none", "metrics", "full"]:
+                        raise ValueError(f"{val} is an invalid {arg} value")
+                elif arg == "-knn-index":
+                    if val not in KNNIndexes:
+                        raise ValueError(f"{val} is an invalid {arg} value")
+                elif arg in ["-models", "-disc", "-eval"]: # Comma separated selections
+                    val = [part.strip() for part in val.split(",") if part.strip() != ""]
+                    if arg == "-models":
+                        SelectModels(val, f"{arg} values")
+                    else:
+                        SelectNames(val, DiscTypes if arg == "-disc" else EvalSets, f"{arg} values")
                 elif arg in ["-out"]: # Folder path values
                     if path.isfile(val):
                         raise ValueError(f"{val} is not a valid folder path")
@@ -104,19 +140,38 @@ class ConsoleOutput:
             self.argDict[arg] = val
             processed += 2
 
-        if self.argDict["-train"] is None:
+        if self.argDict["-train"] is None and self.argDict["-update"] is None:
             self.error("No training file was specifed.")
+        if self.argDict["-eval"] is not None and "test" in SelectNames(self.argDict["-eval"], EvalSets, "-eval values") \
+                and self.argDict["-test"] is None and self.argDict["-update"] is None:
+            self.error("-eval test needs a test file (-test).")
+        if self.argDict["-chunksize"] is not None and any(type(self.argDict[arg]) == list for arg in self.sweepArgs):
+            self.error("-chunksize can not be used with a parameter sweep.")
 
         if self.argDict["-out"]:
             self.out_path = self.argDict["-out"]
             if not os.path.isdir(self.out_path):
                 os.mkdir(self.out_path)
         else:
-            self.out_path = path.split(path.abspath(self.argDict["-train"]))[0]
+            self.out_path = path.split(path.abspath(self.argDict["-train"] or self.argDict["-update"]))[0]
 
         self.log, self.overviewTable = [], None
         print(f"{bcolors.OKGREEN}Command line arguments successfully parsed{bcolors.ENDC}")
+        if self.argDict["-update"] is not None:
+            # Update mode, the models are loaded from the output folder instead of being built
+            builder_path = path.join(self.out_path, "ModelBuilder.joblib")
+            if not path.isfile(builder_path):
+                self.error(f"{builder_path} was not found, build the models with \"-joblib enable\" first.")
+            print(f"{bcolors.OKBLUE}Loading model builder from {builder_path}{bcolors.ENDC}")
+            import joblib as jb
+            self.modelBuilder = jb.load(builder_path)
+            self.modelBuilder.gui, self.modelBuilder.gui_exists = self, True
+            # The builder is saved back to the folder it was loaded from, even if the folder was moved since the build
+            self.modelBuilder.write_dir = self.out_path
+            self.modelBuilder.UpdateModels(self.argDict["-update"], self.argDict["-chunksize"])
+            return
         print(f"{bcolors.OKBLUE}Initializing primary model builder{bcolors.ENDC}")
+        from Models.ModelBuilder import ModelBuilder
         # Create the model builder object (which will do the other things automatically)
         self.modelBuilder = ModelBuilder(self.argDict["-train"],
                                          self.argDict["-struct"],
@@ -128,7 +183,40 @@ class ConsoleOutput:
                                          self.argDict["-joblib"],
                                          self.argDict["-neighbors"],
                                          self.argDict["-clusters"],
+                                         self.argDict["-jobs"],
+                                         self.argDict["-chunksize"],
+                                         self.argDict["-cachesize"],
+                                         self.argDict["-knn-index"],
+                                         self.argDict["-searchjobs"],
+                                         self.argDict["-kmeansbatch"],
+                                         self.argDict["-report"],
+                                         self.argDict["-models"],
+                                         self.argDict["-disc"],
+                                         self.argDict["-eval"],
                                          self)
+    # Options that accept a list (e.g. 0.1,0.2,0.3) or an inclusive range (e.g. 3:11:2) of values
+    sweepArgs = ["-bins", "-gain", "-leafs", "-neighbors", "-clusters"]
+    def parseValues(self, arg, val, cast):
+        values = []
+        for part in val.split(",") if arg in self.sweepArgs else [val]:
+            if ":" not in part or arg not in self.sweepArgs:
+                try:
+                    values.append(cast(part))
+                except: # Replace python-speak with custom message
+                    raise ValueError(f"Invalid {arg} value")
+                continue
+            try:
+                bounds = [cast(bound) for bound in part.split(":")]
+            except: # Replace python-speak with custom message
+                raise ValueError(f"Invalid {arg} range {part}")
+            if len(bounds) not in [2, 3] or bounds[1] < bounds[0] or (len(bounds) == 3 and bounds[2] <= 0):
+                raise ValueError(f"Invalid {arg} range {part}")
+            start, stop, step = bounds if len(bounds) == 3 else (*bounds, 1)
+            # Count the steps first so floating point ranges don't drift
+            values += [cast(round(start + idx * step, 10)) for idx in range(int((stop - start) / step + 1e-9) + 1)]
+        # Remove duplicates while keeping the order
+        return list(dict.fromkeys(values))
+
     # Interface methods for ModelBuilder
     def logLine(self, line):
         line = datetime.now().strftime("%d/%m/%Y %H:%M:%S") + " " + line
@@ -143,19 +231,22 @@ class ConsoleOutput:
             self.overviewTable = self.overviewTable.append(row)
 
     def done(self):
-        with open(path.join(self.out_path, "cli.log"), "w") as logfile:
+        # Updates write their own log and command line copy, so the ones of the build are kept
+        log_name, bat_name = ("update.log", "update.bat") if self.argDict["-update"] is not None else ("cli.log", "execute.bat")
+        with open(path.join(self.out_path, log_name), "w") as logfile:
             logfile.write("\n".join(self.log))
-            print(f"{bcolors.OKGREEN}Log file written to {path.join(self.out_path, 'cli.log')}{bcolors.ENDC}")
+            print(f"{bcolors.OKGREEN}Log file written to {path.join(self.out_path, log_name)}{bcolors.ENDC}")
 
-        if self.overviewTable is not None:
+        if self.overviewTable is not None and self.argDict["-report"] != "none":
             self.overviewTable.to_csv(path.join(self.out_path, "overview.csv"))
             print(f"{bcolors.OKGREEN}Overview table written to {path.join(self.out_path, 'overview.csv')}{bcolors.ENDC}")
+        if self.overviewTable is not None and self.argDict["-report"] == "full":
             self.overviewTable.to_html(path.join(self.out_path, "overview.html"))
             print(f"{bcolors.OKGREEN}Overview table html version written to {path.join(self.out_path, 'overview.html')}{bcolors.ENDC}")
 
-        with open(path.join(self.out_path, "execute.bat"), "w") as bat_file: # Unix support?
+        with open(path.join(self.out_path, bat_name), "w") as bat_file: # Unix support?
             bat_file.write(" ".join(["python", path.realpath(__file__)] + self.args))
-            print(f"{bcolors.OKGREEN}Commandline copy saved to {path.join(self.out_path, 'execute.bat')}{bcolors.ENDC}")
+            print(f"{bcolors.OKGREEN}Commandline copy saved to {path.join(self.out_path, bat_name)}{bcolors.ENDC}")
         
 if __name__ == "__main__":
     ConsoleOutput(sys.argv)
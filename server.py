@@ -0,0 +1,310 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Online scoring server for the models of a ModelBuilder object saved with "-joblib enable",
+# the models and their preprocessing are loaded once and concurrent requests are scored together in batches
+# USAGE: python server.py -out <folder with ModelBuilder.joblib> [Optional arguments]
+import sys
+import io
+import json
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from time import perf_counter
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+import joblib as jb
+
+from Utilities.PDUtils import DistinctRows, ReadCSV
+
+menu = '''Scoring server (server.py)
+USAGE: python server.py -out <path to folder> [Optional arguments]
+Required:
+\t-out    <path to folder> Output folder of a run with "-joblib enable" (ModelBuilder.joblib)
+Optional without specific order:
+\t-host   <address> \t Address to listen on (default is 127.0.0.1)
+\t-port   [1..] \t\t Port to listen on (default is 8080)
+\t-unix   <path to socket> Listen on a unix socket instead of -host and -port
+\t-batch  [1..] \t\t Most rows scored in a single batch (default is 1024)
+\t-wait   [0.0..] \t Milliseconds to wait for more requests before a batch is scored (default is 0,
+\t\t\t\t only the requests that queued up while the previous batch was scored are batched)
+Requests:
+\tPOST /predict \t\t A row (JSON object), rows (JSON list of objects or {"rows": [...]}) or a csv with a header line
+\t\t\t\t (Content-Type: text/csv), returns {"predictions": {model description: [class of every row]}},
+\t\t\t\t "?model=<model description>" (can be repeated) only scores the given models
+\tGET  /models \t\t Descriptions of the loaded models
+\tGET  /stats \t\t Request and per model latency percentiles (milliseconds) and batch sizes
+Miscellaneous:
+\t-help \t\t\t Shows this menu'''
+
+class LatencyStats:
+    '''The most recent samples of a measurement (e.g. seconds per call) and their percentiles'''
+    Percentiles = (50, 90, 99)
+    def __init__(self, size = 10000):
+        self.samples, self.count = deque(maxlen=size), 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self, scale = 1.0):
+        '''Amount of samples and the percentiles of the recent samples (multiplied by scale, e.g. 1000 for milliseconds)'''
+        info = {"count": self.count}
+        if len(self.samples) > 0:
+            values = np.percentile(np.array(self.samples) * scale, self.Percentiles)
+            info.update({f"p{pct}": round(float(value), 3) for pct, value in zip(self.Percentiles, values)})
+        return info
+
+class Scorer:
+    '''
+    The models of a saved ModelBuilder object, ready to score raw rows\n
+    Every batch is encoded once per discretization type (and strict encoding) with the fitted Preprocessor (the same encoding as ModelBuilder)
+    and every model only scores the distinct encoded rows, the time of every model call is kept for the latency percentiles
+    '''
+    def __init__(self, builder):
+        self.struct_file = builder.struct_file if builder.struct_file is not None and path.isfile(builder.struct_file) else None
+        self.preprocessors = builder.preprocessors
+        # Every disc type is processed from the same training data, so they share the columns and the numeric ones
+        preprocessor = next(iter(self.preprocessors.values()))
+        self.columns = [col for col in preprocessor.columns if col != "class"]
+        self.numeric = [col for col in preprocessor.numeric if col != "class"]
+        # description -> ((disc, strict encoding), predict_batch)
+        self.models = {modelObj.description: (builder.EncodingKey(modelObj), modelObj.predict_batch) for modelObj in builder.models}
+        self.latency = {desc: LatencyStats() for desc in self.models}
+
+    def ParseRows(self, body, content_type):
+        '''
+        The rows of a request body, a JSON object, list of objects or {"rows": [...]} (returned as a list of row dicts,
+        the data frame is made once per batch, see BatchFrame) or a csv (returned as a data frame)
+        '''
+        if content_type.startswith("text/csv"):
+            return ReadCSV(io.StringIO(body.decode("utf-8")), self.struct_file)
+        rows = json.loads(body)
+        if isinstance(rows, dict) and isinstance(rows.get("rows"), list):
+            rows = rows["rows"]
+        if isinstance(rows, dict):
+            rows = [rows]
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError("Expected a JSON object, a list of objects or {\"rows\": [...]}")
+        return rows
+
+    def score(self, df, descs):
+        '''Classify every row of df with the models in descs, returns dict of description -> array of classifications'''
+        # Missing columns are added as missing cells (filled by the Preprocessor) and the numeric columns are made numeric
+        df = df.reindex(columns=self.columns)
+        for col in self.numeric:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+        results = dict()
+        for key in dict.fromkeys(self.models[desc][0] for desc in descs):
+            encoded = self.preprocessors[key[0]].transform(df, key[1])
+            rows, groups = DistinctRows(encoded)
+            distinct = encoded.iloc[rows]
+            for desc in descs:
+                modelKey, predict = self.models[desc]
+                if modelKey != key:
+                    continue
+                start = perf_counter()
+                results[desc] = np.asarray(predict(distinct), dtype=object)[groups]
+                self.latency[desc].add(perf_counter() - start)
+        return results
+
+def BatchFrame(parts):
+    '''A single data frame of the rows of every request (see Scorer.ParseRows), consecutive JSON rows are made into one data frame'''
+    frames, records = [], []
+    for part in parts:
+        if isinstance(part, list):
+            records += part
+            continue
+        if len(records) > 0:
+            frames.append(pd.DataFrame(records))
+            records = []
+        frames.append(part)
+    if len(records) > 0:
+        frames.append(pd.DataFrame(records))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0].reset_index(drop=True)
+
+class BatchScorer:
+    '''
+    Coalesces the requests that arrive together into a single Scorer.score call\n
+    The batches are scored one at a time by a worker thread, the requests that arrive meanwhile (or within wait seconds
+    of the first one) form the next batch, up to max_rows rows
+    '''
+    def __init__(self, scorer, max_rows = 1024, wait = 0.0):
+        self.scorer, self.max_rows, self.wait = scorer, max_rows, wait
+        self.queue, self.executor = asyncio.Queue(), ThreadPoolExecutor(max_workers=1)
+        self.requests, self.batch_rows, self.batch_requests = LatencyStats(), LatencyStats(), LatencyStats()
+
+    async def predict(self, df, descs):
+        '''Classify the rows of df (see Scorer.ParseRows) with the models in descs once their batch is scored'''
+        start = perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((df, descs, future))
+        results = await future
+        self.requests.add(perf_counter() - start)
+        return results
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            rows, deadline = len(pending[0][0]), loop.time() + self.wait
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                try:
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                pending.append(item)
+                rows += len(item[0])
+            self.batch_rows.add(rows)
+            self.batch_requests.add(len(pending))
+            descs = list(dict.fromkeys(desc for _, request_descs, _ in pending for desc in request_descs))
+            try:
+                # The batch data frame is made by the worker thread as well, so the event loop keeps accepting requests
+                results = await loop.run_in_executor(self.executor, self.scoreBatch, [df for df, _, _ in pending], descs)
+            except Exception as e:
+                for _, _, future in pending:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for df, request_descs, future in pending:
+                future.set_result({desc: results[desc][offset:offset + len(df)] for desc in request_descs})
+                offset += len(df)
+
+    def scoreBatch(self, parts, descs):
+        return self.scorer.score(BatchFrame(parts), descs)
+
+    def stats(self):
+        return {"requests (ms)": self.requests.summary(1000),
+                "batch rows": self.batch_rows.summary(),
+                "batch requests": self.batch_requests.summary(),
+                "models (ms)": {desc: latency.summary(1000) for desc, latency in self.scorer.latency.items()}}
+
+class ScoringServer:
+    '''Minimal HTTP/1.1 front end (with keep alive) of a BatchScorer, see menu for the requests'''
+    Reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def route(self, method, target, headers, body):
+        url = urlsplit(target)
+        if url.path == "/predict":
+            if method != "POST":
+                return 405, {"error": "Use POST"}
+            descs = parse_qs(url.query).get("model", list(self.batcher.scorer.models))
+            unknown = [desc for desc in descs if desc not in self.batcher.scorer.models]
+            if unknown:
+                return 400, {"error": f"Unknown models: {', '.join(unknown)}"}
+            try:
+                df = self.batcher.scorer.ParseRows(body, headers.get("content-type", "application/json"))
+            except ValueError as ve: # json.JSONDecodeError and pandas parser errors are ValueErrors too
+                return 400, {"error": str(ve)}
+            if len(df) == 0:
+                return 200, {"predictions": {desc: [] for desc in descs}}
+            results = await self.batcher.predict(df, descs)
+            return 200, {"predictions": {desc: values.tolist() for desc, values in results.items()}}
+        if method != "GET":
+            return 405, {"error": "Use GET"}
+        if url.path == "/models":
+            return 200, {"models": list(self.batcher.scorer.models)}
+        if url.path == "/stats":
+            return 200, self.batcher.stats()
+        return 404, {"error": f"{url.path} was not found"}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                try:
+                    status, content = await self.route(method, target, headers, body)
+                except Exception as e:
+                    status, content = 500, {"error": str(e)}
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                payload = json.dumps(content, default=str).encode("utf-8")
+                writer.write(f"{version} {status} {self.Reasons[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                             .encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # Dropped connections and malformed requests just close the connection
+        finally:
+            writer.close()
+
+async def Serve(builder_path, host = "127.0.0.1", port = 8080, unix_path = None, max_rows = 1024, wait = 0.0, started = None):
+    '''
+    Load the ModelBuilder object at builder_path and serve its models until cancelled\n
+    started - optional asyncio.Future that gets the server object once it accepts connections
+    '''
+    batcher = BatchScorer(Scorer(jb.load(builder_path)), max_rows, wait)
+    front = ScoringServer(batcher)
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(front.handle, path=unix_path)
+    else:
+        server = await asyncio.start_server(front.handle, host, port)
+    worker = asyncio.create_task(batcher.run())
+    if started is not None:
+        started.set_result(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker.cancel()
+        batcher.executor.shutdown(wait=False)
+
+def ParseArgs(argv):
+    '''Parse the command line arguments (see menu), returns the argument dict or exits on invalid arguments'''
+    if len(argv) == 1 or "-help" in argv:
+        print(menu)
+        sys.exit(0)
+    args = {"-out": None, "-host": "127.0.0.1", "-port": 8080, "-unix": None, "-batch": 1024, "-wait": 0.0}
+    for idx in range(1, len(argv), 2):
+        arg, val = argv[idx], argv[idx + 1] if idx + 1 < len(argv) else None
+        try:
+            if arg not in args or val is None:
+                raise ValueError(f"Invalid command line argument: {arg}")
+            if arg in ["-port", "-batch"]: # Integer values
+                val = int(val)
+                if val <= 0:
+                    raise ValueError(f"{arg} value must be 1 or higher")
+            elif arg == "-wait": # Floating point values
+                val = float(val)
+                if val < 0.0 or val == float("inf"):
+                    raise ValueError(f"{arg} value must be 0.0 or higher")
+            elif arg == "-out" and not path.isfile(path.join(val, "ModelBuilder.joblib")):
+                raise ValueError(f"{path.join(val, 'ModelBuilder.joblib')} was not found, build the models with \"-joblib enable\" first.")
+        except ValueError as ve: # int() and float() errors are ValueErrors too
+            print(f"ERROR: {ve}")
+            print("Type \"python server.py -help\" to see help information")
+            sys.exit(0)
+        args[arg] = val
+    if args["-out"] is None:
+        print("ERROR: No output folder was specified.")
+        sys.exit(0)
+    return args
+
+if __name__ == "__main__":
+    args = ParseArgs(sys.argv)
+    where = args["-unix"] if args["-unix"] is not None else f"http://{args['-host']}:{args['-port']}"
+    print(f"Serving the models of {path.join(args['-out'], 'ModelBuilder.joblib')} on {where}")
+    try:
+        asyncio.run(Serve(path.join(args["-out"], "ModelBuilder.joblib"), args["-host"], args["-port"], args["-unix"],
+                          args["-batch"], args["-wait"] / 1000))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,33 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+# Shared data of the regression tests, run with "python -m pytest tests" from the project folder
+import sys
+from os import path
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytest
+import pandas as pd
+
+STRUCT_FILE = path.join(ROOT, "Structure.txt")
+
+# The data sets are random samples, the first rows of the files do not have every category of every column
+# (the OrdinalEncoder fit then fails on a column without categories)
+@pytest.fixture(scope="session")
+def train_df():
+    return pd.read_csv(path.join(ROOT, "train.csv")).sample(2000, random_state=0).reset_index(drop=True)
+
+@pytest.fixture(scope="session")
+def test_df():
+    return pd.read_csv(path.join(ROOT, "test.csv")).sample(500, random_state=0).reset_index(drop=True)
+
+@pytest.fixture(scope="session")
+def data_files(tmp_path_factory, train_df, test_df):
+    '''(train file path, test file path) of the sampled data sets'''
+    folder = tmp_path_factory.mktemp("data")
+    train_df.to_csv(folder / "train.csv", index=False)
+    test_df.to_csv(folder / "test.csv", index=False)
+    return str(folder / "train.csv"), str(folder / "test.csv")
@@ -0,0 +1,130 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import json
+import os
+from os import path
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT, STRUCT_FILE
+from Models.ModelBuilder import ModelBuilder
+from Utilities.PDUtils import ReadCSV
+from server import Scorer, BatchFrame
+
+# Type2 Tree and KMEANS are left out, their SKLearn models are randomly initialized so two builds can differ
+MODELS = ["type1bayes", "type2bayes", "type1id3tree", "knn"]
+
+def Build(data_files, folder, **kwargs):
+    train_file, test_file = data_files
+    kwargs = dict(dict(report="metrics", models=MODELS, eval_sets=["test"]), **kwargs)
+    return ModelBuilder(train_file, STRUCT_FILE, test_file, str(folder), **kwargs)
+
+@pytest.fixture(scope="module")
+def builder(data_files, tmp_path_factory):
+    return Build(data_files, tmp_path_factory.mktemp("full"))
+
+def test_chunked_metrics_match(builder, data_files, tmp_path):
+    Build(data_files, tmp_path, chunksize=64)
+    full = pd.read_csv(builder.GetPath("metrics.csv"))
+    chunked = pd.read_csv(tmp_path / "metrics.csv")
+    assert len(full) == len(builder.models)
+    pd.testing.assert_frame_equal(chunked, full)
+
+def test_server_matches_predict_batch(builder, data_files):
+    _, test_file = data_files
+    scorer = Scorer(builder)
+    raw = pd.read_csv(test_file).drop(columns="class")
+    with open(test_file, "rb") as csv_file:
+        csv_body = csv_file.read()
+    # A batch of JSON rows (without some of the columns) and a csv request
+    parts = [scorer.ParseRows(json.dumps(json.loads(raw.to_json(orient="records"))).encode(), "application/json"),
+             scorer.ParseRows(json.dumps({"rows": json.loads(raw[["age", "job"]].head(3).to_json(orient="records"))}).encode(),
+                              "application/json"),
+             scorer.ParseRows(csv_body, "text/csv")]
+    results = scorer.score(BatchFrame(parts), list(scorer.models))
+    expected_df = pd.concat([ReadCSV(test_file, STRUCT_FILE).drop(columns="class"), raw[["age", "job"]].head(3),
+                             ReadCSV(test_file, STRUCT_FILE)], ignore_index=True)
+    for modelObj in builder.models:
+        encoded = builder.preprocessors[modelObj.disc].transform(expected_df, builder.StrictEncoding(modelObj))
+        assert (results[modelObj.description] == np.asarray(modelObj.predict_batch(encoded), dtype=object)).all()
+
+# Correct test data results of the baseline version (python cli.py -train <train> -test <test> -struct Structure.txt)
+# on train.csv.sample(1500, random_state=0) and test.csv.sample(400, random_state=0), the test sample has numeric
+# values outside of the training bins, which the baseline Type1Bayes ignored
+BaselineCorrect = {
+    "Type1 NBC model, equal width disc": 219, "Type1 NBC model, equal depth disc": 251, "Type1 NBC model, entropy disc": 240,
+    "Type2 NBC model, equal width disc": 216, "Type2 NBC model, equal depth disc": 248, "Type2 NBC model, entropy disc": 236,
+    "Type1 Tree model, equal width disc": 194, "Type1 Tree model, equal depth disc": 194, "Type1 Tree model, entropy disc": 194,
+    "KNN model, equal width disc": 198, "KNN model, equal depth disc": 196, "KNN model, entropy disc": 198,
+}
+
+def test_test_data_results_match_baseline(tmp_path):
+    train_file, test_file = str(tmp_path / "train.csv"), str(tmp_path / "test.csv")
+    pd.read_csv(path.join(ROOT, "train.csv")).sample(1500, random_state=0).to_csv(train_file, index=False)
+    pd.read_csv(path.join(ROOT, "test.csv")).sample(400, random_state=0).to_csv(test_file, index=False)
+    Build((train_file, test_file), tmp_path)
+    metrics = pd.read_csv(tmp_path / "metrics.csv")
+    correct = dict(zip(metrics["Model"].str.replace(", test data", ""), metrics["Correct"]))
+    assert correct == BaselineCorrect
+
+class LogOutput:
+    '''Output interface of ModelBuilder (see the output_gui of ModelBuilder) that only keeps the log lines'''
+    def __init__(self):
+        self.lines = []
+    def logLine(self, line):
+        self.lines.append(line)
+    def addRow(self, row):
+        pass
+    def done(self):
+        pass
+
+CacheKwargs = dict(jb_status="enable", models=["type1bayes", "knn"], disc_types=["equal depth"])
+
+@pytest.fixture(scope="module")
+def cached_builder(data_files, tmp_path_factory):
+    return Build(data_files, tmp_path_factory.mktemp("cached"), **CacheKwargs)
+
+def test_model_cache_reuses_models(cached_builder, data_files):
+    output = LogOutput()
+    Build(data_files, cached_builder.write_dir, output_gui=output, **CacheKwargs)
+    assert len([line for line in output.lines if line.startswith("Loaded model")]) == len(cached_builder.models)
+    # Only the model types that use a changed parameter are built again
+    output = LogOutput()
+    Build(data_files, cached_builder.write_dir, output_gui=output, neighbors=3, **CacheKwargs)
+    assert [line for line in output.lines if line.startswith("Saved model")] == ["Saved model KNN model, equal depth disc to joblib file."]
+
+def test_cache_key(cached_builder):
+    disc, bayes, knn = "equal depth", "Type1 NBC model, {0} disc", "KNN model, {0} disc"
+    assert cached_builder.CacheKey(bayes, disc, neighbors=5) == cached_builder.CacheKey(bayes, disc, neighbors=3)
+    assert cached_builder.CacheKey(knn, disc, neighbors=5) != cached_builder.CacheKey(knn, disc, neighbors=3)
+    assert cached_builder.CacheKey(bayes, disc) != cached_builder.CacheKey(knn, disc, neighbors=5)
+    # The key changes with the processed training data
+    data_hash = cached_builder.data_hashes[disc]
+    key = cached_builder.CacheKey(knn, disc, neighbors=5)
+    cached_builder.data_hashes[disc] = "other data"
+    try:
+        assert cached_builder.CacheKey(knn, disc, neighbors=5) != key
+    finally:
+        cached_builder.data_hashes[disc] = data_hash
+
+def test_model_cache_eviction(data_files, tmp_path):
+    builder = Build(data_files, tmp_path, jb_status="enable", cache_size=1, models=["type1bayes"], disc_types=["equal depth"])
+    # Four 400 KB models, the oldest ones are evicted until the rest fits in 1 MB, the preprocessors are kept
+    names = [f"KNN model, equal depth disc - {idx:032x}.joblib" for idx in range(4)] + ["Preprocessor, equal depth disc.joblib"]
+    for name in os.listdir(tmp_path / "models"):
+        os.remove(tmp_path / "models" / name)
+    for age, name in enumerate(names):
+        (tmp_path / "models" / name).write_bytes(bytes(400 * 1024))
+        os.utime(tmp_path / "models" / name, (1000 + age, 1000 + age))
+    builder.EvictModelCache()
+    assert sorted(os.listdir(tmp_path / "models")) == sorted(names[2:])
+
+def test_processed_data_is_only_saved_with_joblib(builder, cached_builder):
+    assert not [name for name in os.listdir(builder.write_dir) if name.startswith("Training file processed")]
+    # One folder per discretization, named by the hash of the data and settings it was processed from
+    saved = [name for name in os.listdir(cached_builder.write_dir) if name.startswith("Training file processed")]
+    assert len(saved) == 1 and saved[0].startswith("Training file processed using equal depth disc - ")
@@ -0,0 +1,27 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import pytest
+
+from Models.Choices import DiscTypes, EvalSets, ModelTypes, SelectNames, SelectModels
+
+def test_select_names():
+    assert SelectNames(None, DiscTypes, "disc types") == list(DiscTypes)
+    # Case insensitive, "-" and "_" match spaces, the result is in the order of the choices
+    assert SelectNames(["Entropy", "equal-DEPTH"], DiscTypes, "disc types") == ["equal depth", "entropy"]
+    assert SelectNames(["equal_width", "equal width"], DiscTypes, "disc types") == ["equal width"]
+    assert SelectNames(["TEST"], EvalSets, "data sets") == ["test"]
+
+def test_select_names_errors():
+    with pytest.raises(ValueError, match="No disc types"):
+        SelectNames([], DiscTypes, "disc types")
+    with pytest.raises(ValueError, match="Invalid data sets train, expected some of: processed, unprocessed, test"):
+        SelectNames(["test", "train"], EvalSets, "data sets")
+
+def test_select_models():
+    assert SelectModels(None) == list(ModelTypes)
+    assert SelectModels(["KNN", "type2tree"]) == ["Type2 Tree model, {0} disc", "KNN model, {0} disc"]
+    with pytest.raises(ValueError, match="Invalid model types tree"):
+        SelectModels(["tree"])
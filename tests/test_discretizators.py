@@ -0,0 +1,33 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import pandas as pd
+import pytest
+
+from Utilities.Discretizators import CutpointEntropy, EntropyDisc
+
+# The DataFrame filtering version EntropyDisc replaced, every unique value is tried as a cutpoint with CutpointEntropy
+def FilteringEntropyDisc(df, attr, levels, init=True):
+    if len(df) <= 1 or levels == 0:
+        return [] if init is False else df[attr]
+    df_orig, df = df, df.sort_values(by=[attr]) if init is True else df
+    unique_values = df[attr].unique()
+    if len(unique_values) <= 1:
+        return [] if init is False else df[attr]
+    entropies = pd.Series({value: CutpointEntropy(df, attr, value) for value in unique_values})
+    cutpoint = entropies.idxmin()
+    S1, S2 = df[df[attr] <= cutpoint], df[df[attr] > cutpoint]
+    cutpoints = FilteringEntropyDisc(S1, attr, levels - 1, False) + [cutpoint] + FilteringEntropyDisc(S2, attr, levels - 1, False)
+    if init is not True:
+        return cutpoints
+    cutpoints += [unique_values.min(), unique_values.max()]
+    return pd.cut(df_orig[attr], sorted(cutpoints), duplicates="drop", include_lowest=True)
+
+@pytest.mark.parametrize("attr", ["age", "balance", "day", "duration", "campaign", "previous"])
+@pytest.mark.parametrize("levels", [1, 2, 3])
+def test_entropy_disc_matches_filtering_version(train_df, attr, levels):
+    # A smaller sample, the filtering version goes over the data once per unique value
+    df = train_df[[attr, "class"]].sample(400, random_state=levels)
+    pd.testing.assert_series_equal(EntropyDisc(df, attr, levels), FilteringEntropyDisc(df, attr, levels))
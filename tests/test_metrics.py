@@ -0,0 +1,50 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import numpy as np
+import pytest
+from sklearn.metrics import confusion_matrix, precision_recall_fscore_support
+
+from Utilities.Metrics import ConfusionMatrices, ClassSupport, ClassMetrics, MetricsTable
+
+CLASSES = ["no", "yes", "maybe"]
+
+@pytest.fixture
+def predictions():
+    '''(true classes, models x rows predictions), with None predictions and a model that never predicts "maybe"'''
+    rng = np.random.RandomState(0)
+    y_true = rng.choice(CLASSES, 300)
+    predictions = rng.choice(CLASSES + [None], (4, 300)).astype(object)
+    predictions[3][predictions[3] == "maybe"] = "no"
+    return y_true, predictions
+
+def test_confusion_matrices_match_sklearn(predictions):
+    y_true, predictions = predictions
+    matrices = ConfusionMatrices(y_true, predictions, CLASSES)
+    for matrix, predicted in zip(matrices, predictions):
+        # SKLearn does not take None next to strings, the rows predicted None are left out of both
+        known = predicted != None
+        assert (matrix == confusion_matrix(y_true[known], predicted[known].astype(str), labels=CLASSES)).all()
+
+def test_class_metrics_match_sklearn(predictions):
+    y_true, predictions = predictions
+    support = ClassSupport(y_true, CLASSES)
+    precision, recall, f1 = ClassMetrics(ConfusionMatrices(y_true, predictions, CLASSES), support)
+    for idx, predicted in enumerate(predictions):
+        # None predictions are errors, as a label that is not one of the classes
+        expected = precision_recall_fscore_support(y_true, np.where(predicted == None, "none", predicted).astype(str),
+                                                   labels=CLASSES, zero_division=0)
+        np.testing.assert_allclose(precision[idx], expected[0])
+        np.testing.assert_allclose(recall[idx], expected[1])
+        np.testing.assert_allclose(f1[idx], expected[2])
+        assert (support == expected[3]).all()
+
+def test_metrics_table(predictions):
+    y_true, predictions = predictions
+    matrices = dict(zip("abcd", ConfusionMatrices(y_true, predictions, CLASSES)))
+    table = MetricsTable("test data", CLASSES, matrices, ClassSupport(y_true, CLASSES))
+    assert list(table["Total Entries"]) == [300] * 4
+    assert list(table["Correct"]) == [(predicted == y_true).sum() for predicted in predictions]
+    assert (table["maybe precision"].iloc[3], table["maybe recall"].iloc[3]) == (0, 0)
@@ -0,0 +1,127 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import pickle
+import numpy as np
+import pytest
+from sklearn.neighbors import KNeighborsClassifier
+
+from conftest import STRUCT_FILE
+from Models.Type1Bayes import Type1Bayes
+from Models.Type2Bayes import Type2Bayes
+from Models.Type1ID3Tree import Type1ID3Tree, ID3Builder
+from Models.Type2Tree import Type2Tree
+from Models.KNN import KNN, DistanceTableIndex, HNSWIndex
+from Models.KMEANS import KMEANS
+import Utilities.PDUtils as utils
+from Utilities.PDUtils import CleanDataFrame
+
+@pytest.fixture(scope="module")
+def processed(train_df, test_df):
+    '''(processed training data, preprocessor, preprocessed test data) with equal depth discretization'''
+    df, preprocessor = CleanDataFrame(train_df.copy(), 5, "equal depth", STRUCT_FILE)
+    return df, preprocessor, preprocessor.transform(test_df)
+
+def ModelKwargs(preprocessor):
+    return dict(encoder=preprocessor.encoder, lookups=preprocessor.lookups)
+
+@pytest.mark.parametrize("model_class", [Type1Bayes, Type2Bayes, Type1ID3Tree, Type2Tree, KNN, KMEANS])
+def test_predict_batch_matches_evaluate(processed, model_class):
+    df, preprocessor, test = processed
+    model = model_class(df, **ModelKwargs(preprocessor))
+    evaluated = np.array([model.evaluate(row) for _, row in test.iterrows()], dtype=object)
+    assert (np.asarray(model.predict_batch(test), dtype=object) == evaluated).all()
+
+def test_type1bayes_ignores_out_of_range_values(processed, test_df):
+    df, preprocessor, _ = processed
+    model = Type1Bayes(df, **ModelKwargs(preprocessor))
+    # Raw rows, numeric values outside of every interval count as unknown values
+    raw = test_df.drop(columns="class").copy()
+    raw.loc[::3, "balance"] = 10 ** 7
+    evaluated = np.array([model.evaluate(row) for _, row in raw.iterrows()], dtype=object)
+    assert (evaluated == model.predict_batch(raw)).all()
+    # and are ignored like missing values
+    missing = raw.copy()
+    missing.loc[::3, "balance"] = np.nan
+    assert (model.predict_batch(raw) == model.predict_batch(missing)).all()
+
+def test_id3_builder_matches_gain(processed):
+    # The baseline data had the intervals and labels in object columns
+    df = processed[0].astype(object)
+    builder = ID3Builder(df)
+    attrs = [attr for attr in df if attr != "class"]
+    rng = np.random.RandomState(0)
+    # The root and random subsets of rows, like the nodes of a tree
+    for rows in [np.arange(len(df))] + [np.sort(rng.choice(len(df), size, replace=False)) for size in (700, 150, 30)]:
+        subset = df.iloc[rows]
+        gains = builder.gains(rows, attrs)
+        for attr in attrs:
+            split_entropy = utils.Entropy(subset[attr])
+            expected = 0 if split_entropy == 0 else utils.Gain(subset, attr) / split_entropy
+            assert gains[attr] == expected
+        assert builder.classResult(rows)[0] == subset["class"].value_counts().idxmax()
+
+def test_pruned_tree_matches_fresh_build(processed):
+    df, preprocessor, test = processed
+    loosest = Type1ID3Tree(df, min_gain=0, leaf_limit=0, **ModelKwargs(preprocessor))
+    for min_gain, leaf_limit in [(0.0, 0), (0.01, 0), (0.05, 0), (0.3, 0), (0.01, 20), (0.05, 100)]:
+        fresh = Type1ID3Tree(df, min_gain=min_gain, leaf_limit=leaf_limit, **ModelKwargs(preprocessor))
+        pruned = loosest.pruned(min_gain, leaf_limit)
+        assert (pruned.predict_batch(test) == fresh.predict_batch(test)).all()
+        assert (pruned.predict_batch(df) == fresh.predict_batch(df)).all()
+
+@pytest.mark.parametrize("model_class", [Type1Bayes, Type2Bayes])
+def test_partial_fit_matches_full_fit(processed, model_class):
+    df, preprocessor, test = processed
+    full = model_class(df, **ModelKwargs(preprocessor))
+    first, second = df.iloc[:len(df) // 2], df.iloc[len(df) // 2:]
+    updated = model_class(first, **ModelKwargs(preprocessor)).partial_fit(second)
+    assert (updated.predict_batch(test) == full.predict_batch(test)).all()
+    if model_class is Type1Bayes:
+        assert (updated.class_counts == full.class_counts).all()
+        assert all((updated.counts[col] == full.counts[col]).all() for col in full.counts)
+
+def BruteForceNeighbors(codes, y, queries, k):
+    '''The class votes of the k nearest training rows, nearest first, at the same distance by first appearance of the vector then row order'''
+    _, first_seen, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    rank = np.lexsort((np.arange(len(codes)), first_seen[inverse.reshape(-1)]))
+    classes = np.unique(y)
+    results = []
+    for query in queries:
+        distances = ((codes[rank] - query) ** 2).sum(axis=1)
+        nearest = rank[np.argsort(distances, kind="stable")[:k]]
+        results.append(classes[np.argmax([(y[nearest] == value).sum() for value in classes])])
+    return np.array(results)
+
+@pytest.fixture(scope="module")
+def neighbor_codes(processed):
+    df, preprocessor, test = processed
+    x, y = utils.SplitXY(df)
+    codes = utils.EncodeDataFrame(x, preprocessor.encoder.categories_, preprocessor.lookups)
+    queries = utils.EncodeDataFrame(test.drop(columns="class"), preprocessor.encoder.categories_, preprocessor.lookups)
+    return codes, np.asarray(y), queries[(queries >= 0).all(axis=1)], [len(categories) for categories in preprocessor.encoder.categories_]
+
+@pytest.mark.parametrize("k", [1, 5, 12])
+def test_distance_table_matches_brute_force(neighbor_codes, k):
+    codes, y, queries, sizes = neighbor_codes
+    index = DistanceTableIndex(codes, y, k, sizes)
+    assert (index.predict(queries) == BruteForceNeighbors(codes, y, queries, k)).all()
+    # KNeighborsClassifier picks other rows at the same distance, but agrees when the k-th and next nearest rows are not tied
+    brute = KNeighborsClassifier(n_neighbors=k, algorithm="brute").fit(codes, y).predict(queries)
+    nearest = np.sort(((queries[:, None, :] - codes[None, :, :]) ** 2).sum(axis=2), axis=1)
+    untied = nearest[:, k - 1] != nearest[:, k]
+    assert (index.predict(queries)[untied] == brute[untied]).all()
+    # The tables are rebuilt after loading
+    assert (pickle.loads(pickle.dumps(index)).predict(queries) == index.predict(queries)).all()
+
+@pytest.mark.parametrize("k", [1, 5, 12])
+def test_hnsw_index_finds_nearest_neighbors(neighbor_codes, k):
+    codes, y, queries, sizes = neighbor_codes
+    index = HNSWIndex(codes, y, k)
+    # The distance of the nearest vector found, nearly always the exact one
+    found = index.search(queries, np.full(len(queries), index.entry), index.graphs[0], index.EF_SEARCH)[1][:, 0]
+    exact = ((queries[:, None, :] - index.vectors[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+    assert (found >= exact).all() and (found == exact).mean() > 0.98
+    assert (index.predict(queries) == DistanceTableIndex(codes, y, k, sizes).predict(queries)).mean() > 0.9
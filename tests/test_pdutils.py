@@ -0,0 +1,56 @@
+# Authors:
+# Baruch Rutman
+# Dor Rozenhak
+# Roi Amzallag
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import STRUCT_FILE
+from Models.Choices import DiscTypes
+from Utilities.PDUtils import CleanDataFrame, FindBestInterval, ReadCSV, SaveCodes, LoadCodes
+
+@pytest.mark.parametrize("disc_type", DiscTypes)
+def test_interval_lookup_matches_find_best_interval(train_df, disc_type):
+    _, preprocessor = CleanDataFrame(train_df.copy(), 5, disc_type, STRUCT_FILE)
+    rng = np.random.RandomState(0)
+    for col, lookup in preprocessor.lookups.items():
+        intervals = preprocessor.dtypes[col].categories
+        low, high = lookup.left[0], lookup.right[-1]
+        # Training values, the interval edges and values below and above every interval
+        values = np.concatenate([train_df[col].values, lookup.left, lookup.right,
+                                 rng.uniform(low - (high - low), high + (high - low), 200)]).astype(float)
+        expected = [FindBestInterval(value, intervals) for value in values]
+        assert [lookup.find(value) for value in values] == expected
+        assert list(lookup.intervals[lookup.codes(values)]) == expected
+
+        # Strict codes are the same for the values inside an interval and -1 for the rest
+        strict = lookup.codes(values, strict=True)
+        inside = np.array([any(value in interval for interval in intervals) for value in values])
+        assert ((strict >= 0) == inside).all()
+        assert (strict[inside] == lookup.codes(values)[inside]).all()
+
+def test_undeclared_labels_are_unknown(train_df, test_df, tmp_path):
+    _, preprocessor = CleanDataFrame(train_df.copy(), 5, "equal depth", STRUCT_FILE)
+    raw = test_df.head(20).copy()
+    raw.loc[::2, "job"] = "Astronaut"
+    raw.to_csv(tmp_path / "test.csv", index=False)
+    read = ReadCSV(str(tmp_path / "test.csv"), STRUCT_FILE)
+    assert read["job"].isna().sum() == 0
+    # A csv and the same rows as plain values (a JSON body of the scoring server) are encoded the same way
+    from_csv, from_values = preprocessor.transform(read), preprocessor.transform(raw)
+    assert (from_csv["job"].cat.codes.values[::2] == -1).all()
+    pd.testing.assert_frame_equal(from_csv, from_values)
+
+def test_save_codes_round_trip(train_df, tmp_path):
+    df, _ = CleanDataFrame(train_df.copy(), 5, "entropy", STRUCT_FILE)
+    df.index = df.index * 2
+    SaveCodes(df, str(tmp_path))
+    loaded = LoadCodes(str(tmp_path))
+    pd.testing.assert_frame_equal(loaded, df)
+    # Saving other data to the same folder does not change a data set that was loaded from it (memory mapped)
+    other, _ = CleanDataFrame(train_df.iloc[::-1].copy(), 5, "entropy", STRUCT_FILE)
+    SaveCodes(other, str(tmp_path))
+    pd.testing.assert_frame_equal(loaded, df)
+    pd.testing.assert_frame_equal(LoadCodes(str(tmp_path)), other)